@@ -2,19 +2,42 @@
 # -*- coding: utf-8 -*-
 
 import os
+import io
+import csv
+import json
+import itertools
+import mimetypes
+import collections
+import math
+import time
+import base64
 import hashlib
+import tempfile
+import threading
 from datetime import datetime
 from functools import wraps
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, abort
+import click
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, abort, g, has_app_context, make_response, Response, stream_with_context, before_render_template, template_rendered
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 import bleach
 import markdown
 from dotenv import load_dotenv
 
+import search
+from db_pool import engine_options, pool_status
+from metrics import RequestMetrics, CallbackCounter, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from response_cache import ResponseCache, MemoryLRUBackend, FileBackend
+from io_worker import IOQueue, job as io_job
+from ratelimit import LoginLimiter, MemoryBackend as RateLimitMemoryBackend, SQLiteBackend as RateLimitSQLiteBackend, parse_rate
+from cover_variants import VARIANT_SIZES, VARIANT_FORMATS, VARIANTS_DIRNAME, variant_path, generate_variant, generate_variants, remove_variants
+
 # Load environment variables
 load_dotenv()
 
@@ -22,19 +45,32 @@ app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 
 # Database configuration
-DATABASE_URL = f"mysql+pymysql://{os.environ.get('DB_USER', 'root')}:{os.environ.get('DB_PASSWORD', '')}@{os.environ.get('DB_HOST', 'localhost')}/{os.environ.get('DB_NAME', 'electronic_library')}?charset=utf8mb4"
+DATABASE_URL = os.environ.get('DATABASE_URL') or f"mysql+pymysql://{os.environ.get('DB_USER', 'root')}:{os.environ.get('DB_PASSWORD', '')}@{os.environ.get('DB_HOST', 'localhost')}/{os.environ.get('DB_NAME', 'electronic_library')}?charset=utf8mb4"
 
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Пул соединений: DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URL)
 
 # Upload configuration
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_TMP_PREFIX = '.upload-'
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Каталог: 'offset' (номера страниц) или 'cursor' (keyset по (year, id))
+app.config['CATALOG_PAGINATION'] = os.environ.get('CATALOG_PAGINATION', 'offset')
+# Общее число книг для номеров страниц: 'exact', 'cached' или 'approximate'
+app.config['CATALOG_COUNT_MODE'] = os.environ.get('CATALOG_COUNT_MODE', 'exact')
+app.config['CATALOG_COUNT_TTL'] = int(os.environ.get('CATALOG_COUNT_TTL', 60))
+
+# Отдавать число SQL-запросов запроса в заголовке X-Query-Count
+app.config['QUERY_COUNT_HEADER'] = os.environ.get('QUERY_COUNT_HEADER') == '1'
+
 # Initialize extensions
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
@@ -42,10 +78,127 @@ migrate = Migrate(app, db)
 # Create upload directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Кеш роли в подписанной сессии (по умолчанию выключен): роль перечитывается из
+# базы не реже раза в SESSION_ROLE_TTL секунд, а увеличение ROLE_VERSION сбрасывает
+# кеш у всех сразу. Пока кеш жив, снятый администратор сохраняет свои права
+app.config['SESSION_ROLE_CACHE'] = os.environ.get('SESSION_ROLE_CACHE', '0') == '1'
+app.config['SESSION_ROLE_TTL'] = int(os.environ.get('SESSION_ROLE_TTL', 60))
+app.config['ROLE_VERSION'] = os.environ.get('ROLE_VERSION', '1')
+
+# Кеш страниц для анонимных посетителей: 'memory' (один процесс), 'file'
+# (общий для воркеров на одной машине) или 'off'. Кеш в памяти у каждого
+# воркера свой: правка в одном воркере не сбрасывает страницы в остальных,
+# а команды flask books его не видят вовсе, поэтому под gunicorn нужен 'file'
+app.config['RESPONSE_CACHE'] = os.environ.get('RESPONSE_CACHE', 'off')
+app.config['RESPONSE_CACHE_MAX_BYTES'] = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+app.config['RESPONSE_CACHE_DIR'] = os.environ.get('RESPONSE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'exam-response-cache'))
+app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+
+# Фоновые файловые операции: число потоков (0 - выполнять сразу) и журнал заданий
+app.config['IO_WORKERS'] = int(os.environ.get('IO_WORKERS', 2))
+app.config['IO_MAX_ATTEMPTS'] = int(os.environ.get('IO_MAX_ATTEMPTS', 3))
+app.config['IO_JOURNAL_DIR'] = os.environ.get('IO_JOURNAL_DIR', os.path.join(app.instance_path, 'io-journal'))
+
+# Ограничение попыток входа: 'memory', 'sqlite' (общий файл для воркеров) или 'off';
+# лимиты - "попыток подряд/секунд на восстановление"
+app.config['LOGIN_RATE_LIMIT'] = os.environ.get('LOGIN_RATE_LIMIT', 'memory')
+app.config['LOGIN_RATE_LIMIT_PATH'] = os.environ.get('LOGIN_RATE_LIMIT_PATH', os.path.join(app.instance_path, 'login-ratelimit.sqlite3'))
+app.config['LOGIN_IP_RATE'] = os.environ.get('LOGIN_IP_RATE', '20/60')
+app.config['LOGIN_USER_RATE'] = os.environ.get('LOGIN_USER_RATE', '5/60')
+
+# Число обратных прокси (nginx и т.п.) перед приложением, чьим X-Forwarded-For и
+# X-Forwarded-Proto можно верить. Без этого request.remote_addr - адрес прокси,
+# и лимит входа по IP оказывается общим для всех посетителей
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
+
+RATING_STARS = range(1, 6)
+REVIEWS_PER_PAGE = 20
+COLLECTION_BATCH_LIMIT = 1000
+# Соседей книги, сохраняемых flask books recommend, и показываемых на её странице
+SIMILAR_BOOKS_TOP_K = 20
+SIMILAR_BOOKS_LIMIT = 6
+
+# Версия рендеринга описаний книг; книги с другой версией перерисовываются
+DESCRIPTION_RENDERER_VERSION = 1
+
+# Метрики /metrics и заголовок Server-Timing
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+request_metrics = RequestMetrics()
+
+# Per-request SQL query counter and timer
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def time_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if has_app_context():
+        g.db_time = g.get('db_time', 0.0) + elapsed
+
+@db.event.listens_for(Engine, 'handle_error')
+def forget_failed_query(exception_context):
+    # after_cursor_execute для упавшего запроса не вызывается
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.setdefault('render_started', []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_render_timer(sender, template, context, **extra):
+    started = g.get('render_started')
+    if started:
+        elapsed = time.perf_counter() - started.pop()
+        # Вложенный render_template уже учтён во внешнем
+        if not started:
+            g.render_time = g.get('render_time', 0.0) + elapsed
+
+@app.before_request
+def reset_request_state():
+    g.query_count = 0
+    g.db_time = 0.0
+    g.render_time = 0.0
+    g.request_started = time.perf_counter()
+    g.pop('current_user', None)
+
+@app.after_request
+def add_query_count_header(response):
+    if app.config['QUERY_COUNT_HEADER']:
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+    return response
+
+@app.after_request
+def record_request_metrics(response):
+    if not app.config['METRICS_ENABLED'] or 'request_started' not in g:
+        return response
+    total = time.perf_counter() - g.request_started
+    db_time = g.get('db_time', 0.0)
+    render_time = g.get('render_time', 0.0)
+    response.headers['Server-Timing'] = (
+        f'db;dur={db_time * 1000:.1f}, render;dur={render_time * 1000:.1f}, total;dur={total * 1000:.1f}'
+    )
+    # Непредусмотренные URL (404) сводим в одну метку, чтобы не плодить серии
+    endpoint = request.url_rule.endpoint if request.url_rule else 'unmatched'
+    request_metrics.observe(
+        endpoint, request.method, response.status_code, total, db_time,
+        g.get('query_count', 0),
+        None if response.is_streamed else response.calculate_content_length(),
+    )
+    return response
+
 # Association tables
 book_genres = db.Table('book_genres',
     db.Column('book_id', db.Integer, db.ForeignKey('books.id'), primary_key=True),
-    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True)
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True),
+    # Первичный ключ начинается с book_id; фильтру по жанру нужен свой индекс
+    db.Index('ix_book_genres_genre_id', 'genre_id'),
 )
 
 collection_books = db.Table('collection_books',
@@ -103,6 +256,8 @@ class Cover(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     mime_type = db.Column(db.String(100), nullable=False)
     md5_hash = db.Column(db.String(32), unique=True, nullable=False)
+    # Число книг с этой обложкой; файл удаляется, когда счётчик доходит до нуля
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     books = db.relationship('Book', backref='cover', lazy=True)
 
@@ -118,25 +273,234 @@ class Book(db.Model):
     pages = db.Column(db.Integer, nullable=False)
     cover_id = db.Column(db.Integer, db.ForeignKey('covers.id'), nullable=False)
     
+    # Денормализованные агрегаты рецензий, обновляются вместе с reviews
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_avg = db.Column(db.Float)
+    # Число оценок каждого балла (RATING_STARS) для гистограммы на странице книги
+    rating_1 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_2 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_3 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_4 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_5 = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
+    # Готовый HTML описания и версия рендерера, которой он получен
+    description_html = db.Column(db.Text)
+    description_html_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     genres = db.relationship('Genre', secondary=book_genres, lazy='subquery',
                            backref=db.backref('books', lazy=True))
     reviews = db.relationship('Review', backref='book', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (db.Index('ix_books_year_id', 'year', 'id'),)
+    
     @property
     def average_rating(self):
-        review_list = list(self.reviews)
-        if not review_list:
+        if not self.rating_count:
             return None
-        return sum(review.rating for review in review_list) / len(review_list)
+        return self.rating_avg
     
     @property
     def review_count(self):
-        return len(list(self.reviews))
+        return self.rating_count or 0
+    
+    @property
+    def rating_distribution(self):
+        """{балл: число оценок} от 5 до 1"""
+        return {stars: getattr(self, f'rating_{stars}') or 0 for stars in reversed(RATING_STARS)}
+    
+    def render_description(self):
+        self.description_html = render_markdown(self.description)
+        self.description_html_version = DESCRIPTION_RENDERER_VERSION
     
     @property
     def genres_list(self):
         return ', '.join([genre.name for genre in list(self.genres)])
 
+# Поля книги, показанные в карточке каталога, и поля готового HTML описания
+CATALOG_ATTRIBUTES = frozenset({'title', 'author', 'publisher', 'year', 'description', 'cover_id',
+                                'rating_avg', 'rating_count', 'genres'})
+DESCRIPTION_RENDER_ATTRIBUTES = frozenset({'description_html', 'description_html_version'})
+
+def _acquire_cover(connection, cover_id):
+    covers = Cover.__table__
+    connection.execute(covers.update().where(covers.c.id == cover_id).values(ref_count=covers.c.ref_count + 1))
+
+def _release_cover(connection, session, cover_id):
+    """Уменьшает ref_count; обложка без ссылок удаляется, файл - после коммита"""
+    covers = Cover.__table__
+    connection.execute(covers.update().where(covers.c.id == cover_id).values(ref_count=covers.c.ref_count - 1))
+    orphan = connection.execute(
+        db.select(covers.c.filename, covers.c.md5_hash, covers.c.ref_count).where(covers.c.id == cover_id)
+    ).first()
+    if orphan is None:
+        return
+    if orphan.ref_count < 0:
+        # Счётчик разошёлся с books: обложку могут использовать другие книги, ничего не удаляем
+        app.logger.error('Отрицательный ref_count у обложки %s, запустите flask covers recount', cover_id)
+        return
+    if orphan.ref_count == 0:
+        connection.execute(covers.delete().where(covers.c.id == cover_id))
+        schedule_after_commit(session, 'remove_cover',
+                              upload_folder=app.config['UPLOAD_FOLDER'], filename=orphan.filename, md5_hash=orphan.md5_hash)
+
+search.install(Book.__table__)
+
+@db.event.listens_for(Book, 'after_insert')
+def book_after_insert(mapper, connection, book):
+    _acquire_cover(connection, book.cover_id)
+    search.index_book(connection, book)
+    invalidate_pages(db.object_session(book), 'catalog')
+
+@db.event.listens_for(Book, 'after_update')
+def book_after_update(mapper, connection, book):
+    state = db.inspect(book)
+    history = state.attrs.cover_id.history
+    if history.has_changes():
+        _acquire_cover(connection, book.cover_id)
+        for old_cover_id in history.deleted:
+            if old_cover_id is not None:
+                _release_cover(connection, db.object_session(book), old_cover_id)
+    
+    if any(state.attrs[column].history.has_changes() for column in search.SEARCH_COLUMNS):
+        search.index_book(connection, book)
+    
+    # Перерисовка описания тем же текстом страниц не меняет, а каталог
+    # зависит только от показанных в карточке книги полей
+    changed = {attr.key for attr in state.attrs if attr.history.has_changes()}
+    if changed & CATALOG_ATTRIBUTES:
+        invalidate_pages(db.object_session(book), f'book:{book.id}', 'catalog')
+    elif changed - DESCRIPTION_RENDER_ATTRIBUTES:
+        invalidate_pages(db.object_session(book), f'book:{book.id}')
+
+@db.event.listens_for(Book, 'after_delete')
+def book_after_delete(mapper, connection, book):
+    _release_cover(connection, db.object_session(book), book.cover_id)
+    search.unindex_book(connection, book.id)
+    invalidate_pages(db.object_session(book), f'book:{book.id}', 'catalog')
+
+# Файловые операции выполняются фоновой очередью и только по итогам транзакции
+_io_queue_lock = threading.Lock()
+
+def get_io_queue():
+    """Очередь файловых операций процесса; запускается при первом обращении"""
+    with _io_queue_lock:
+        queue = app.extensions.get('io_queue')
+        if queue is not None and queue.pid == os.getpid():
+            return queue
+        queue = IOQueue(app.config['IO_JOURNAL_DIR'], workers=app.config['IO_WORKERS'],
+                        max_attempts=app.config['IO_MAX_ATTEMPTS']).start()
+        app.extensions['io_queue'] = queue
+    # Повтор - вне блокировки и после регистрации очереди: при IO_WORKERS=0
+    # задания выполняются прямо здесь и сами ставят следующие
+    queue.replay_orphans()
+    return queue
+
+@app.before_request
+def start_io_queue():
+    # Очередь запускается с первым запросом воркера, а не с первой загрузкой обложки:
+    # иначе задания, записанные в журнал до падения, ждали бы неопределённо долго
+    queue = app.extensions.get('io_queue')
+    if queue is None or queue.pid != os.getpid():
+        get_io_queue()
+
+def schedule_after_commit(session, name, **args):
+    session.info.setdefault('io_after_commit', []).append((name, args))
+
+def schedule_after_rollback(session, name, **args):
+    session.info.setdefault('io_after_rollback', []).append((name, args))
+
+@db.event.listens_for(db.session, 'after_commit')
+def submit_committed_io(session):
+    session.info.pop('io_after_rollback', None)
+    for name, args in session.info.pop('io_after_commit', []):
+        get_io_queue().submit(name, **args)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def submit_rolled_back_io(session):
+    session.info.pop('io_after_commit', None)
+    for name, args in session.info.pop('io_after_rollback', []):
+        get_io_queue().submit(name, **args)
+
+@io_job('persist_cover')
+def persist_cover(queue, upload_folder, tmp_path, filename, md5_hash):
+    """Переносит загрузку на место обложки; варианты готовятся отдельным заданием"""
+    file_path = os.path.join(upload_folder, filename)
+    if os.path.exists(tmp_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        os.replace(tmp_path, file_path)
+    elif not os.path.exists(file_path):
+        app.logger.error('Загрузка %s пропала до сохранения обложки %s', tmp_path, filename)
+        return
+    queue.submit('cover_variants', upload_folder=upload_folder, filename=filename, md5_hash=md5_hash)
+
+@io_job('cover_variants')
+def build_cover_variants(queue, upload_folder, filename, md5_hash):
+    """Готовит варианты новой обложки; если не получится, они создадутся лениво"""
+    file_path = os.path.join(upload_folder, filename)
+    if os.path.exists(file_path):
+        generate_variants(file_path, upload_folder, md5_hash)
+
+@io_job('remove_cover')
+def remove_cover_files(queue, upload_folder, filename, md5_hash):
+    # Путь обложки задаётся её хешем: если ту же картинку успели загрузить снова
+    # (или задание повторяется из журнала), файл уже принадлежит новой записи
+    with app.app_context():
+        if db.session.scalar(db.select(Cover.id).where(Cover.md5_hash == md5_hash).limit(1)) is not None:
+            return
+    file_path = os.path.join(upload_folder, filename)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    remove_variants(upload_folder, md5_hash)
+
+@io_job('remove_file')
+def remove_file(queue, path):
+    if os.path.exists(path):
+        os.remove(path)
+
+def get_response_cache():
+    """Кеш страниц по текущим настройкам или None, если он выключен"""
+    mode = app.config['RESPONSE_CACHE']
+    if mode == 'off':
+        return None
+    caches = app.extensions.setdefault('response_cache', {})
+    if mode not in caches:
+        max_bytes = app.config['RESPONSE_CACHE_MAX_BYTES']
+        if mode == 'file':
+            backend = FileBackend(app.config['RESPONSE_CACHE_DIR'], max_bytes)
+        else:
+            backend = MemoryLRUBackend(max_bytes)
+        caches[mode] = ResponseCache(backend, app.config['RESPONSE_CACHE_TTL'])
+    return caches[mode]
+
+def invalidate_pages(session, *versions):
+    """Увеличивает версии кеша страниц после коммита текущей транзакции"""
+    session.info.setdefault('page_versions_to_bump', set()).update(versions)
+
+def bump_page_versions(*versions):
+    cache = get_response_cache()
+    if cache is not None:
+        cache.bump(*versions)
+
+def bump_page_versions_from_command(*versions):
+    """Сбрасывает кеш страниц из CLI-команды. Кеш в памяти живёт внутри процессов
+    веб-сервера, поэтому команда его не видит и только предупреждает об этом"""
+    if app.config['RESPONSE_CACHE'] == 'memory':
+        click.echo('Кеш страниц в памяти (RESPONSE_CACHE=memory) из команды не сбросить: '
+                   'перезапустите веб-сервер или дождитесь истечения RESPONSE_CACHE_TTL', err=True)
+        return
+    bump_page_versions(*versions)
+
+@db.event.listens_for(db.session, 'after_commit')
+def apply_page_invalidations(session):
+    versions = session.info.pop('page_versions_to_bump', None)
+    if versions and has_app_context():
+        bump_page_versions(*versions)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def forget_page_invalidations(session):
+    session.info.pop('page_versions_to_bump', None)
+
 class Review(db.Model):
     __tablename__ = 'reviews'
     
@@ -147,7 +511,40 @@ class Review(db.Model):
     text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
-    __table_args__ = (db.UniqueConstraint('book_id', 'user_id', name='unique_user_book_review'),)
+    __table_args__ = (
+        db.UniqueConstraint('book_id', 'user_id', name='unique_user_book_review'),
+        db.Index('ix_reviews_book_created', 'book_id', 'created_at'),
+        db.Index('ix_reviews_user_id', 'user_id'),
+    )
+
+def _apply_rating_delta(connection, book_id, rating, sign):
+    """Сдвигает агрегаты и гистограмму рейтинга книги одним UPDATE в текущей транзакции"""
+    if rating not in RATING_STARS:
+        raise ValueError(f'Недопустимая оценка: {rating}')
+    books = Book.__table__
+    new_sum = books.c.rating_sum + sign * rating
+    new_count = books.c.rating_count + sign
+    star_column = books.c[f'rating_{rating}']
+    connection.execute(
+        books.update()
+        .where(books.c.id == book_id)
+        .values({
+            books.c.rating_sum: new_sum,
+            books.c.rating_count: new_count,
+            books.c.rating_avg: db.case((new_count > 0, db.cast(new_sum, db.Float) / new_count), else_=None),
+            star_column: star_column + sign,
+        })
+    )
+
+@db.event.listens_for(Review, 'after_insert')
+def review_after_insert(mapper, connection, review):
+    _apply_rating_delta(connection, review.book_id, review.rating, 1)
+    invalidate_pages(db.object_session(review), f'book:{review.book_id}', 'catalog')
+
+@db.event.listens_for(Review, 'after_delete')
+def review_after_delete(mapper, connection, review):
+    _apply_rating_delta(connection, review.book_id, review.rating, -1)
+    invalidate_pages(db.object_session(review), f'book:{review.book_id}', 'catalog')
 
 class Collection(db.Model):
     __tablename__ = 'collections'
@@ -157,14 +554,153 @@ class Collection(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     
-    books = db.relationship('Book', secondary=collection_books, lazy='subquery',
+    __table_args__ = (db.Index('ix_collections_user_created', 'user_id', 'created_at'),)
+    
+    books = db.relationship('Book', secondary=collection_books, lazy=True,
                            backref=db.backref('collections', lazy=True))
     
-    @property
-    def book_count(self):
-        return len(list(self.books))
+    # COUNT по collection_books вместо загрузки книг; в списках подгружается через undefer
+    book_count = db.column_property(
+        db.select(db.func.count(collection_books.c.book_id))
+        .where(collection_books.c.collection_id == id)
+        .correlate_except(collection_books)
+        .scalar_subquery(),
+        deferred=True
+    )
+
+class ImportProgress(db.Model):
+    """Сколько записей файла импорта уже закоммичено; обновляется в той же транзакции"""
+    __tablename__ = 'import_progress'
+    
+    source = db.Column(db.String(255), primary_key=True)
+    offset = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class BookSimilar(db.Model):
+    """Похожие книги по оценкам читателей, rank 0 - самая близкая; заполняется
+    командой flask books recommend"""
+    __tablename__ = 'book_similar'
+    
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    similar_book_id = db.Column(db.Integer, db.ForeignKey('books.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    
+    __table_args__ = (db.Index('ix_book_similar_similar_book_id', 'similar_book_id'),)
+
+class RecommendationRun(db.Model):
+    """Запуски расчёта похожих книг; started_at последнего завершённого - граница
+    для инкрементального обновления"""
+    __tablename__ = 'recommendation_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    full = db.Column(db.Boolean, nullable=False, default=False)
+    books_updated = db.Column(db.Integer, nullable=False, default=0)
+
+@db.event.listens_for(Book, 'before_delete')
+def book_forget_similar(mapper, connection, book):
+    # В SQLite внешние ключи не проверяются, поэтому ON DELETE CASCADE дублируем здесь
+    similar = BookSimilar.__table__
+    listed_on = connection.scalars(db.select(similar.c.book_id).where(similar.c.similar_book_id == book.id))
+    invalidate_pages(db.object_session(book), *(f'book:{book_id}' for book_id in listed_on))
+    connection.execute(similar.delete().where(
+        db.or_(similar.c.book_id == book.id, similar.c.similar_book_id == book.id)
+    ))
+
+def similar_books_query(book_id, limit=SIMILAR_BOOKS_LIMIT):
+    """Готовый список похожих книг одним запросом по первичному ключу book_similar"""
+    return (
+        Book.query
+        .join(BookSimilar, BookSimilar.similar_book_id == Book.id)
+        .filter(BookSimilar.book_id == book_id)
+        .order_by(BookSimilar.rank)
+        .options(db.noload(Book.genres), db.raiseload('*'))
+        .limit(limit)
+    )
+
+def similar_books(book_id, limit=SIMILAR_BOOKS_LIMIT):
+    return similar_books_query(book_id, limit).all()
+
+# Справочник жанров процесса
+GenreEntry = collections.namedtuple('GenreEntry', 'id name')
+
+class GenreRegistry:
+    """Жанры, прочитанные из БД один раз; сбрасываются при изменении genres в этом
+    процессе, а изменения из других воркеров подхватываются по истечении ttl"""
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = None
+        self._by_id = {}
+        self._loaded_at = 0.0
+    
+    def _load(self):
+        with self._lock:
+            if self._entries is None or time.monotonic() - self._loaded_at > self.ttl:
+                rows = db.session.execute(db.select(Genre.id, Genre.name).order_by(Genre.id)).all()
+                self._entries = tuple(GenreEntry(*row) for row in rows)
+                self._by_id = {entry.id: entry for entry in self._entries}
+                self._loaded_at = time.monotonic()
+            return self._entries, self._by_id
+    
+    def all(self):
+        return self._load()[0]
+    
+    def get(self, genre_id):
+        return self._load()[1].get(genre_id)
+    
+    def known_ids(self, genre_ids):
+        """Существующие id из genre_ids (в исходном порядке, без повторов)"""
+        genre_ids = list(dict.fromkeys(genre_ids))
+        by_id = self._load()[1]
+        if any(genre_id not in by_id for genre_id in genre_ids):
+            # Жанр мог появиться в другом процессе: перечитываем один раз
+            self.invalidate()
+            by_id = self._load()[1]
+        return [genre_id for genre_id in genre_ids if genre_id in by_id]
+    
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+genre_registry = GenreRegistry(ttl=int(os.environ.get('GENRE_CACHE_TTL', 300)))
+
+@db.event.listens_for(Genre, 'after_insert')
+@db.event.listens_for(Genre, 'after_update')
+@db.event.listens_for(Genre, 'after_delete')
+def genre_changed(mapper, connection, genre):
+    # Сброс до коммита дал бы другому запросу перечитать ещё старые жанры
+    session = db.object_session(genre)
+    session.info['genre_registry_stale'] = True
+    # Названия жанров есть и в каталоге, и на страницах книг
+    invalidate_pages(session, 'shared')
+
+@db.event.listens_for(db.session, 'after_commit')
+def apply_genre_invalidation(session):
+    if session.info.pop('genre_registry_stale', False):
+        genre_registry.invalidate()
+
+@db.event.listens_for(db.session, 'after_rollback')
+def forget_genre_invalidation(session):
+    session.info.pop('genre_registry_stale', None)
+
+def load_genres(genre_ids):
+    """Жанры для присвоения книге одним IN-запросом"""
+    genre_ids = genre_registry.known_ids(genre_ids)
+    if not genre_ids:
+        return []
+    return Genre.query.filter(Genre.id.in_(genre_ids)).order_by(Genre.id).all()
 
 # Helper functions
+def collection_has_book(collection_id, book_id):
+    return db.session.scalar(db.select(db.exists().where(
+        collection_books.c.collection_id == collection_id,
+        collection_books.c.book_id == book_id,
+    )))
+
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -185,8 +721,7 @@ def admin_required(f):
             flash('Для выполнения данного действия необходимо пройти процедуру аутентификации')
             return redirect(url_for('login'))
         
-        user = User.query.get(session['user_id'])
-        if not user or user.role.name != 'администратор':
+        if get_user_role() != 'администратор':
             flash('У вас недостаточно прав для выполнения данного действия')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
@@ -199,19 +734,77 @@ def moderator_or_admin_required(f):
             flash('Для выполнения данного действия необходимо пройти процедуру аутентификации')
             return redirect(url_for('login'))
         
-        user = User.query.get(session['user_id'])
-        if not user or user.role.name not in ['администратор', 'модератор']:
+        if get_user_role() not in ['администратор', 'модератор']:
             flash('У вас недостаточно прав для выполнения данного действия')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
     return decorated_function
 
+def cached_page(*versions):
+    """Отдаёт анонимным посетителям сохранённую страницу; versions - имена версий
+    данных страницы, в них подставляются аргументы view (например, 'book:{book_id}')"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            cache = get_response_cache()
+            # Страница с flash-сообщением предназначена одному посетителю
+            if cache is None or request.method != 'GET' or 'user_id' in session or '_flashes' in session:
+                return f(*args, **kwargs)
+            
+            # Версии читаются до выполнения view: если данные изменятся во время
+            # рендеринга, запись окажется под старым ключом и не будет найдена
+            key = cache.key(request.full_path, [name.format(**kwargs) for name in versions])
+            cached = cache.get(key)
+            if cached is not None:
+                content_type, body = cached
+                response = app.response_class(body, content_type=content_type)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+            
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed and '_flashes' not in session:
+                cache.set(key, response.content_type, response.get_data())
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return decorated_function
+    return decorator
+
+def get_current_user():
+    """Пользователь запроса вместе с ролью; загружается не больше одного раза за запрос"""
+    if 'user_id' not in session:
+        return None
+    
+    if 'current_user' not in g:
+        g.current_user = User.query.options(db.joinedload(User.role)).filter_by(id=session['user_id']).first()
+    return g.current_user
+
+def remember_role(user):
+    if not app.config['SESSION_ROLE_CACHE']:
+        # Без кеша сессия не меняется, и cookie не переписывается на каждом запросе
+        return
+    session['role_name'] = user.role.name
+    session['role_version'] = app.config['ROLE_VERSION']
+    session['role_cached_at'] = int(time.time())
+
 def get_user_role():
     if 'user_id' not in session:
         return None
     
-    user = User.query.get(session['user_id'])
-    return user.role.name if user else None
+    # Роль из подписанной сессии годится, пока не изменился ROLE_VERSION и не истёк TTL
+    if (app.config['SESSION_ROLE_CACHE'] and 'role_name' in session
+            and session.get('role_version') == app.config['ROLE_VERSION']
+            and time.time() - session.get('role_cached_at', 0) < app.config['SESSION_ROLE_TTL']):
+        return session['role_name']
+    
+    user = get_current_user()
+    if not user:
+        return None
+    remember_role(user)
+    return user.role.name
+
+@app.context_processor
+def inject_user_role():
+    return {'user_role': get_user_role()}
 
 def sanitize_html(text):
     allowed_tags = ['p', 'br', 'strong', 'b', 'em', 'i', 'u', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
@@ -222,14 +815,164 @@ def sanitize_html(text):
     }
     return bleach.clean(text, tags=allowed_tags, attributes=allowed_attributes)
 
+def render_markdown(text):
+    """Markdown -> очищенный HTML; при смене правил увеличьте DESCRIPTION_RENDERER_VERSION"""
+    return sanitize_html(markdown.markdown(text)) if text else ''
+
+def encode_cursor(values, direction):
+    payload = json.dumps([*values, direction], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token, types):
+    """Возвращает (значения ключа, direction) или None для битого токена"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        *values, direction = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ('next', 'prev') or len(values) != len(types):
+            return None
+        return tuple(convert(value) for convert, value in zip(types, values)), direction
+    except (ValueError, TypeError):
+        return None
+
+def book_cursor(book, direction):
+    return encode_cursor([book.year, book.id], direction)
+
+# Порядок каталога; по нему построен индекс ix_books_year_id
+CATALOG_ORDER = (Book.year.desc(), Book.id.desc())
+
+def catalog_query():
+    """Книги каталога: страница, жанры и обложки пачкой, рейтинги - из столбцов books"""
+    return Book.query.options(
+        db.selectinload(Book.genres),
+        db.selectinload(Book.cover),
+        db.raiseload('*'),
+    )
+
+def keyset_query(query, position, per_page):
+    """Запрос страницы по ключу (year, id): position - ((year, id), 'next' | 'prev') или None;
+    берётся на строку больше, чтобы узнать, есть ли следующая страница"""
+    if position is None:
+        return query.order_by(*CATALOG_ORDER).limit(per_page + 1)
+    (year, book_id), direction = position
+    if direction == 'next':
+        return query.filter(db.or_(
+            Book.year < year,
+            db.and_(Book.year == year, Book.id < book_id),
+        )).order_by(*CATALOG_ORDER).limit(per_page + 1)
+    return query.filter(db.or_(
+        Book.year > year,
+        db.and_(Book.year == year, Book.id > book_id),
+    )).order_by(Book.year.asc(), Book.id.asc()).limit(per_page + 1)
+
+def keyset_page(query, cursor, per_page):
+    """Страница каталога по ключу (year, id) без OFFSET и COUNT"""
+    position = decode_cursor(cursor, (int, int)) if cursor else None
+    rows = keyset_query(query, position, per_page).all()
+    
+    if position is None:
+        has_more = len(rows) > per_page
+        books = rows[:per_page]
+        next_cursor = book_cursor(books[-1], 'next') if has_more else None
+        return books, next_cursor, None
+    
+    _, direction = position
+    if direction == 'next':
+        has_more = len(rows) > per_page
+        books = rows[:per_page]
+        next_cursor = book_cursor(books[-1], 'next') if has_more else None
+        prev_cursor = book_cursor(books[0], 'prev') if books else None
+    else:
+        has_more = len(rows) > per_page
+        books = list(reversed(rows[:per_page]))
+        next_cursor = book_cursor(books[-1], 'next') if books else None
+        prev_cursor = book_cursor(books[0], 'prev') if has_more else None
+    
+    return books, next_cursor, prev_cursor
+
+def review_page_query(book_id, position, user_id, per_page=REVIEWS_PER_PAGE):
+    """Запрос страницы рецензий после position ((created_at, id), направление) вместе
+    с рецензией пользователя user_id"""
+    window = db.select(Review.id).where(Review.book_id == book_id)
+    if user_id is not None:
+        window = window.where(Review.user_id != user_id)
+    if position is not None:
+        (created_at, review_id), _ = position
+        window = window.where(db.or_(
+            Review.created_at < created_at,
+            db.and_(Review.created_at == created_at, Review.id < review_id),
+        ))
+    window = window.order_by(Review.created_at.desc(), Review.id.desc()).limit(per_page + 1)
+    
+    # Окно страницы и своя рецензия (по unique_user_book_review) одним UNION
+    ids = db.select(window.subquery())
+    if user_id is not None:
+        ids = db.union(ids, db.select(Review.id).where(Review.book_id == book_id, Review.user_id == user_id))
+    ids = ids.subquery()
+    
+    return (Review.query.join(ids, ids.c.id == Review.id)
+            .options(db.joinedload(Review.user))
+            .order_by(Review.created_at.desc(), Review.id.desc()))
+
+def review_page(book_id, cursor, user_id, per_page=REVIEWS_PER_PAGE):
+    """Страница рецензий по ключу (created_at, id) и рецензия текущего пользователя за один запрос"""
+    position = decode_cursor(cursor, (datetime.fromisoformat, int)) if cursor else None
+    rows = review_page_query(book_id, position, user_id, per_page).all()
+    
+    user_review = next((review for review in rows if review.user_id == user_id), None)
+    reviews = [review for review in rows if review is not user_review]
+    next_cursor = None
+    if len(reviews) > per_page:
+        reviews = reviews[:per_page]
+        last = reviews[-1]
+        next_cursor = encode_cursor([last.created_at.isoformat(), last.id], 'next')
+    return reviews, user_review, next_cursor
+
+_catalog_count_cache = {}
+
+def catalog_total():
+    """Число книг для номеров страниц в режиме CATALOG_COUNT_MODE"""
+    mode = app.config['CATALOG_COUNT_MODE']
+    if mode == 'exact':
+        return db.session.scalar(db.select(db.func.count()).select_from(Book))
+    
+    cached = _catalog_count_cache.get('total')
+    if cached and cached[1] > time.monotonic():
+        return cached[0]
+    
+    total = None
+    if mode == 'approximate' and db.engine.dialect.name == 'mysql':
+        # Оценка InnoDB из статистики таблицы, без сканирования индекса
+        total = db.session.execute(db.text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'books'"
+        )).scalar()
+    if total is None:
+        total = db.session.scalar(db.select(db.func.count()).select_from(Book))
+    
+    _catalog_count_cache['total'] = (total, time.monotonic() + app.config['CATALOG_COUNT_TTL'])
+    return total
+
 # Routes
 @app.route('/')
+@cached_page('catalog', 'shared')
 def index():
     page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor')
     per_page = 10
     
-    books_pagination = Book.query.order_by(Book.year.desc(), Book.id.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    # Фиксированный бюджет запросов: страница, жанры и обложки пачкой
+    query = catalog_query()
+    
+    if cursor is not None or app.config['CATALOG_PAGINATION'] == 'cursor':
+        books, next_cursor, prev_cursor = keyset_page(query, cursor, per_page)
+        return render_template('index.html',
+                             books=books,
+                             cursor_mode=True,
+                             next_cursor=next_cursor,
+                             prev_cursor=prev_cursor)
+    
+    books_pagination = query.order_by(*CATALOG_ORDER).paginate(
+        page=page, per_page=per_page, error_out=False, count=False
     )
     
     books = books_pagination.items
@@ -237,20 +980,177 @@ def index():
     return render_template('index.html', 
                          books=books, 
                          page=page, 
-                         total_pages=books_pagination.pages,
-                         user_role=get_user_role())
+                         total_pages=math.ceil(catalog_total() / per_page))
+
+def search_queries(bind, query_text, genre_ids, year_from, year_to, page, per_page):
+    """(результаты, счётчики по жанрам) для страницы поиска или None, если искать нечего"""
+    matches = search.match_query(bind, Book.__table__, query_text)
+    if matches is None:
+        return None
+    matches = matches.subquery()
+    filters = []
+    if year_from is not None:
+        filters.append(Book.year >= year_from)
+    if year_to is not None:
+        filters.append(Book.year <= year_to)
+    
+    genre_filter = []
+    if genre_ids:
+        genre_filter.append(db.exists().where(
+            book_genres.c.book_id == Book.id,
+            book_genres.c.genre_id.in_(genre_ids),
+        ))
+    
+    results = (
+        db.select(Book, matches.c.score)
+        .join(matches, matches.c.book_id == Book.id)
+        .where(*filters, *genre_filter)
+        .options(db.selectinload(Book.genres), db.selectinload(Book.cover), db.raiseload('*'))
+        .order_by(matches.c.score.desc(), Book.id.desc())
+        .limit(per_page + 1).offset((page - 1) * per_page)
+    )
+    # Счётчики по жанрам считаются без фильтра по жанру, чтобы было видно,
+    # сколько результатов даст выбор другого жанра
+    facets = (
+        db.select(Genre.id, Genre.name, db.func.count(book_genres.c.book_id).label('count'))
+        .join(book_genres, book_genres.c.genre_id == Genre.id)
+        .join(Book, Book.id == book_genres.c.book_id)
+        .join(matches, matches.c.book_id == Book.id)
+        .where(*filters)
+        .group_by(Genre.id, Genre.name)
+        .order_by(db.desc('count'), Genre.name)
+    )
+    return results, facets
+
+@app.route('/search')
+def search_books():
+    query_text = request.args.get('q', '').strip()
+    genre_ids = request.args.getlist('genre', type=int)
+    year_from = request.args.get('year_from', type=int)
+    year_to = request.args.get('year_to', type=int)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 20
+    
+    books, facets, has_next = [], [], False
+    statements = search_queries(db.engine, query_text, genre_ids, year_from, year_to, page, per_page)
+    
+    if statements is not None:
+        results, facet_counts = statements
+        rows = db.session.execute(results).all()
+        has_next = len(rows) > per_page
+        books = [book for book, _ in rows[:per_page]]
+        facets = db.session.execute(facet_counts).all()
+    
+    return render_template('search.html',
+                         books=books,
+                         facets=facets,
+                         query=query_text,
+                         selected_genres=genre_ids,
+                         year_from=year_from,
+                         year_to=year_to,
+                         page=page,
+                         has_next=has_next)
 
 @app.route('/cover/<int:cover_id>')
 def serve_cover(cover_id):
-    """Отдает файл обложки по ID"""
+    """Отдает файл обложки по ID, при ?size= - уменьшенный вариант"""
     cover = Cover.query.get_or_404(cover_id)
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], cover.filename)
     
-    if os.path.exists(file_path):
-        return send_file(file_path, mimetype=cover.mime_type)
-    else:
+    if not os.path.exists(file_path):
         # Возвращаем заглушку, если файл не найден
         abort(404)
+    
+    size = request.args.get('size')
+    if size not in VARIANT_SIZES:
+        return send_file(file_path, mimetype=cover.mime_type)
+    
+    # WebP только при явном упоминании: image/* шлют и браузеры без поддержки WebP
+    fmt = 'webp' if 'image/webp' in request.accept_mimetypes.values() else 'jpeg'
+    path = variant_path(app.config['UPLOAD_FOLDER'], cover.md5_hash, size, fmt)
+    if not os.path.exists(path):
+        # Обложки, загруженные до появления вариантов, уменьшаются при первом запросе
+        try:
+            path = generate_variant(file_path, app.config['UPLOAD_FOLDER'], cover.md5_hash, size, fmt)
+        except OSError:
+            app.logger.exception('Не удалось создать вариант обложки %s', cover_id)
+            return send_file(file_path, mimetype=cover.mime_type)
+    
+    response = send_file(path, mimetype=VARIANT_FORMATS[fmt][1])
+    response.vary.add('Accept')
+    return response
+
+def cover_storage_path(md5_hash, extension):
+    """Путь обложки относительно UPLOAD_FOLDER: ab/cd/abcd....jpg"""
+    return f"{md5_hash[:2]}/{md5_hash[2:4]}/{md5_hash}.{extension}"
+
+def stream_upload(file_storage):
+    """Пишет загрузку кусками во временный файл в UPLOAD_FOLDER, попутно считая MD5"""
+    return stream_to_temp(file_storage.stream)
+
+def stream_to_temp(stream):
+    md5 = hashlib.md5()
+    fd, tmp_path = tempfile.mkstemp(dir=app.config['UPLOAD_FOLDER'], prefix=UPLOAD_TMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                md5.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, md5.hexdigest()
+
+def store_cover(cover_file):
+    """Возвращает обложку с тем же MD5 или добавляет загрузку как новую; файл
+    переносится на место фоновым заданием после коммита"""
+    tmp_path, cover_hash = stream_upload(cover_file)
+    try:
+        existing_cover = Cover.query.filter_by(md5_hash=cover_hash).first()
+        if existing_cover:
+            get_io_queue().submit('remove_file', path=tmp_path)
+            return existing_cover
+        
+        filename = secure_filename(cover_file.filename)
+        file_extension = filename.split('.')[-1].lower() if '.' in filename else 'jpg'
+        cover = Cover(
+            filename=cover_storage_path(cover_hash, file_extension),
+            mime_type=cover_file.content_type or 'image/jpeg',
+            md5_hash=cover_hash
+        )
+        db.session.add(cover)
+        db.session.flush()
+    except BaseException:
+        get_io_queue().submit('remove_file', path=tmp_path)
+        raise
+    
+    upload_folder = app.config['UPLOAD_FOLDER']
+    schedule_after_commit(db.session, 'persist_cover',
+                          upload_folder=upload_folder, tmp_path=tmp_path, filename=cover.filename, md5_hash=cover_hash)
+    schedule_after_rollback(db.session, 'remove_file', path=tmp_path)
+    return cover
+
+def get_login_limiter():
+    """Ограничитель попыток входа по текущим настройкам или None, если он выключен"""
+    mode = app.config['LOGIN_RATE_LIMIT']
+    if mode == 'off':
+        return None
+    limiters = app.extensions.setdefault('login_limiter', {})
+    if mode not in limiters:
+        if mode == 'sqlite':
+            backend = RateLimitSQLiteBackend(app.config['LOGIN_RATE_LIMIT_PATH'])
+        else:
+            backend = RateLimitMemoryBackend()
+        limiters[mode] = LoginLimiter(backend, parse_rate(app.config['LOGIN_IP_RATE']),
+                                      parse_rate(app.config['LOGIN_USER_RATE']))
+    return limiters[mode]
+
+def _login_attempt_counts():
+    limiter = get_login_limiter()
+    return {(result,): count for result, count in limiter.counters.items()} if limiter else {}
+
+request_metrics.registry.register(CallbackCounter(
+    'login_attempts_total', 'Попытки входа по решению ограничителя', ('result',), _login_attempt_counts))
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -259,11 +1159,22 @@ def login():
         password = request.form['password']
         remember = 'remember' in request.form
         
-        user = User.query.filter_by(username=username).first()
+        # Отказ до запроса к БД и дорогого check_password_hash
+        limiter = get_login_limiter()
+        if limiter is not None:
+            result, retry_after = limiter.check(request.remote_addr, username)
+            if result != 'allowed':
+                flash('Слишком много попыток входа. Повторите попытку позже')
+                response = make_response(render_template('login.html'), 429)
+                response.headers['Retry-After'] = str(math.ceil(retry_after))
+                return response
+        
+        user = User.query.options(db.joinedload(User.role)).filter_by(username=username).first()
         
         if user and user.check_password(password):
             session['user_id'] = user.id
             session['user_name'] = user.full_name
+            remember_role(user)
             
             if remember:
                 session.permanent = True
@@ -280,23 +1191,25 @@ def logout():
     return redirect(url_for('index'))
 
 @app.route('/book/<int:book_id>')
+@cached_page('book:{book_id}', 'shared')
 def book_detail(book_id):
     book = Book.query.get_or_404(book_id)
     
-    reviews = Review.query.filter_by(book_id=book_id).order_by(Review.created_at.desc()).all()
-    
-    user_review = None
-    if 'user_id' in session:
-        user_review = Review.query.filter_by(book_id=book_id, user_id=session['user_id']).first()
+    if book.description_html_version != DESCRIPTION_RENDERER_VERSION:
+        # Описание сохранено старым рендерером или до появления description_html
+        book.render_description()
+        db.session.commit()
     
-    book_description_html = markdown.markdown(book.description) if book.description else ''
+    reviews, user_review, next_cursor = review_page(book_id, request.args.get('reviews'), session.get('user_id'))
     
     return render_template('book_detail.html', 
                          book=book, 
-                         book_description_html=book_description_html,
+                         book_description_html=book.description_html,
                          reviews=reviews,
                          user_review=user_review,
-                         user_role=get_user_role())
+                         first_page=not request.args.get('reviews'),
+                         next_reviews_cursor=next_cursor,
+                         similar=similar_books(book_id))
 
 @app.route('/book/add', methods=['GET', 'POST'])
 @admin_required
@@ -308,7 +1221,7 @@ def add_book():
         author = request.form['author']
         publisher = request.form['publisher']
         pages = request.form['pages']
-        genre_ids = request.form.getlist('genres')
+        genre_ids = request.form.getlist('genres', type=int)
         cover_file = request.files['cover']
         
         description = sanitize_html(description)
@@ -317,52 +1230,20 @@ def add_book():
             flash('Необходимо загрузить обложку книги')
             return render_template('book_form.html', 
                                  book=None, 
-                                 genres=Genre.query.all(), 
+                                 genres=genre_registry.all(), 
+                                 current_genres=genre_ids,
                                  form_data=request.form)
         
         if not allowed_file(cover_file.filename):
             flash('Недопустимый формат файла обложки')
             return render_template('book_form.html', 
                                  book=None, 
-                                 genres=Genre.query.all(), 
+                                 genres=genre_registry.all(), 
+                                 current_genres=genre_ids,
                                  form_data=request.form)
         
         try:
-            cover_data = cover_file.read()
-            cover_hash = hashlib.md5(cover_data).hexdigest()
-            
-            existing_cover = Cover.query.filter_by(md5_hash=cover_hash).first()
-            
-            if existing_cover:
-                cover = existing_cover
-            else:
-                if cover_file.filename:
-                    filename = secure_filename(cover_file.filename)
-                    mime_type = cover_file.content_type or 'image/jpeg'
-                    
-                    cover = Cover(
-                        filename=filename,
-                        mime_type=mime_type,
-                        md5_hash=cover_hash
-                    )
-                    db.session.add(cover)
-                    db.session.flush()
-                    
-                    file_extension = filename.split('.')[-1] if '.' in filename else 'jpg'
-                    new_filename = f"{cover.id}.{file_extension}"
-                    cover.filename = new_filename
-                    
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                    print(f"Saving cover to: {file_path}")  # Debug
-                    print(f"Upload folder: {app.config['UPLOAD_FOLDER']}")  # Debug
-                    print(f"File exists after save: {os.path.exists(file_path)}")  # Debug
-                    
-                    with open(file_path, 'wb') as f:
-                        f.write(cover_data)
-                    
-                    print(f"File saved, size: {os.path.getsize(file_path)} bytes")  # Debug
-                    print(f"File still exists: {os.path.exists(file_path)}")  # Debug
-                    print(f"Files in folder: {os.listdir(app.config['UPLOAD_FOLDER'])}")  # Debug
+            cover = store_cover(cover_file)
             
             book = Book(
                 title=title,
@@ -373,18 +1254,12 @@ def add_book():
                 pages=int(pages),
                 cover_id=cover.id
             )
+            book.render_description()
             
-            db.session.add(book)  # Сначала добавляем книгу в сессию
-            
-            # Потом добавляем жанры
-            for genre_id in genre_ids:
-                genre = Genre.query.get(int(genre_id))
-                if genre:
-                    book.genres.append(genre)
-            print(f"Before commit - file exists: {os.path.exists(file_path)}")  # Debug
+            db.session.add(book)
+            book.genres = load_genres(genre_ids)
             db.session.commit()
-            print(f"After commit - file exists: {os.path.exists(file_path)}")  # Debug
-            print(f"After commit - files: {os.listdir(app.config['UPLOAD_FOLDER'])}")  # Debug
+            _catalog_count_cache.clear()
             
             flash('Книга успешно добавлена')
             return redirect(url_for('book_detail', book_id=book.id))
@@ -394,10 +1269,11 @@ def add_book():
             flash('При сохранении данных возникла ошибка. Проверьте корректность введённых данных.')
             return render_template('book_form.html', 
                                  book=None, 
-                                 genres=Genre.query.all(), 
+                                 genres=genre_registry.all(), 
+                                 current_genres=genre_ids,
                                  form_data=request.form)
     
-    return render_template('book_form.html', book=None, genres=Genre.query.all())
+    return render_template('book_form.html', book=None, genres=genre_registry.all())
 
 @app.route('/book/<int:book_id>/edit', methods=['GET', 'POST'])
 @moderator_or_admin_required
@@ -411,7 +1287,7 @@ def edit_book(book_id):
         author = request.form['author']
         publisher = request.form['publisher']
         pages = request.form['pages']
-        genre_ids = request.form.getlist('genres')
+        genre_ids = request.form.getlist('genres', type=int)
         cover_file = request.files.get('cover')
         
         description = sanitize_html(description)
@@ -419,6 +1295,7 @@ def edit_book(book_id):
         try:
             book.title = title
             book.description = description
+            book.render_description()
             book.year = int(year)
             book.author = author
             book.publisher = publisher
@@ -430,67 +1307,13 @@ def edit_book(book_id):
                     flash('Недопустимый формат файла обложки')
                     return render_template('book_form.html', 
                                          book=book, 
-                                         current_genres=[genre.id for genre in book.genres],
-                                         genres=Genre.query.all())
+                                         current_genres=genre_ids,
+                                         genres=genre_registry.all())
                 
-                # Читаем файл и вычисляем хеш
-                cover_data = cover_file.read()
-                cover_hash = hashlib.md5(cover_data).hexdigest()
-                
-                # Проверяем, существует ли уже такая обложка
-                existing_cover = Cover.query.filter_by(md5_hash=cover_hash).first()
-                
-                if existing_cover:
-                    # Используем существующую обложку
-                    old_cover_id = book.cover_id
-                    book.cover_id = existing_cover.id
-                    
-                    # Удаляем старую обложку, если она не используется другими книгами
-                    if old_cover_id:
-                        old_cover = Cover.query.get(old_cover_id)
-                        if old_cover and Book.query.filter_by(cover_id=old_cover_id).count() == 0:
-                            old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], old_cover.filename)
-                            if os.path.exists(old_file_path):
-                                os.remove(old_file_path)
-                            db.session.delete(old_cover)
-                else:
-                    # Создаем новую обложку
-                    filename = secure_filename(cover_file.filename)
-                    mime_type = cover_file.content_type or 'image/jpeg'
-                    
-                    new_cover = Cover()
-                    new_cover.filename = filename
-                    new_cover.mime_type = mime_type
-                    new_cover.md5_hash = cover_hash
-                    db.session.add(new_cover)
-                    db.session.flush()
-                    
-                    # Сохраняем файл с ID в имени
-                    file_extension = filename.split('.')[-1] if '.' in filename else 'jpg'
-                    new_filename = f"{new_cover.id}.{file_extension}"
-                    new_cover.filename = new_filename
-                    
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                    with open(file_path, 'wb') as f:
-                        f.write(cover_data)
-                    
-                    # Удаляем старую обложку
-                    old_cover_id = book.cover_id
-                    book.cover_id = new_cover.id
-                    
-                    if old_cover_id:
-                        old_cover = Cover.query.get(old_cover_id)
-                        if old_cover and Book.query.filter_by(cover_id=old_cover_id).count() == 0:
-                            old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], old_cover.filename)
-                            if os.path.exists(old_file_path):
-                                os.remove(old_file_path)
-                            db.session.delete(old_cover)
+                # Старая обложка освобождается по ref_count при сохранении книги
+                book.cover_id = store_cover(cover_file).id
             
-            book.genres.clear()
-            for genre_id in genre_ids:
-                genre = Genre.query.get(int(genre_id))
-                if genre:
-                    book.genres.append(genre)
+            book.genres = load_genres(genre_ids)
             
             db.session.commit()
             
@@ -506,7 +1329,7 @@ def edit_book(book_id):
     return render_template('book_form.html', 
                          book=book, 
                          current_genres=current_genres,
-                         genres=Genre.query.all())
+                         genres=genre_registry.all())
 
 @app.route('/book/<int:book_id>/delete', methods=['POST'])
 @admin_required
@@ -514,15 +1337,10 @@ def delete_book(book_id):
     book = Book.query.get_or_404(book_id)
     
     try:
-        cover_filename = book.cover.filename if book.cover else None
-        
+        # Файл обложки удаляется после коммита, только если на неё больше нет ссылок
         db.session.delete(book)
         db.session.commit()
-        
-        if cover_filename:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], cover_filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        _catalog_count_cache.clear()
         
         flash('Книга успешно удалена')
         
@@ -569,23 +1387,34 @@ def add_review(book_id):
     return render_template('review_form.html', book_title=book.title, book_id=book_id)
 
 # Collection routes
+def user_collections_query(user_id):
+    """Подборки пользователя, новые первыми, с числом книг без их загрузки"""
+    return (Collection.query.filter_by(user_id=user_id)
+            .options(db.undefer(Collection.book_count))
+            .order_by(Collection.created_at.desc()))
+
+def collection_books_query(collection_id):
+    """Книги подборки; жанры на её странице не показываются"""
+    return (Book.query
+            .join(collection_books, collection_books.c.book_id == Book.id)
+            .filter(collection_books.c.collection_id == collection_id)
+            .options(db.noload(Book.genres), db.raiseload('*')))
+
 @app.route('/collections')
 @login_required
 def my_collections():
-    user = User.query.get(session['user_id'])
-    if not user or user.role.name != 'пользователь':
+    if get_user_role() != 'пользователь':
         flash('Доступ запрещен')
         return redirect(url_for('index'))
     
-    collections = Collection.query.filter_by(user_id=session['user_id']).order_by(Collection.created_at.desc()).all()
+    collections = user_collections_query(session['user_id']).all()
     
-    return render_template('collections.html', collections=collections, user_role=get_user_role())
+    return render_template('collections.html', collections=collections)
 
 @app.route('/collections/add', methods=['POST'])
 @login_required
 def add_collection():
-    user = User.query.get(session['user_id'])
-    if not user or user.role.name != 'пользователь':
+    if get_user_role() != 'пользователь':
         flash('Доступ запрещен')
         return redirect(url_for('index'))
     
@@ -612,6 +1441,26 @@ def add_collection():
     
     return redirect(url_for('my_collections'))
 
+@app.route('/collections/<int:collection_id>/delete', methods=['POST'])
+@login_required
+def delete_collection(collection_id):
+    collection = Collection.query.get_or_404(collection_id)
+    
+    if collection.user_id != session['user_id']:
+        flash('Доступ запрещен')
+        return redirect(url_for('my_collections'))
+    
+    try:
+        db.session.delete(collection)
+        db.session.commit()
+        flash('Подборка удалена')
+        
+    except Exception as e:
+        db.session.rollback()
+        flash('Ошибка при удалении подборки')
+    
+    return redirect(url_for('my_collections'))
+
 @app.route('/collections/<int:collection_id>')
 @login_required
 def collection_detail(collection_id):
@@ -621,13 +1470,13 @@ def collection_detail(collection_id):
         flash('Доступ запрещен')
         return redirect(url_for('my_collections'))
     
-    return render_template('collection_detail.html', collection=collection, user_role=get_user_role())
+    return render_template('collection_detail.html', collection=collection,
+                         books=collection_books_query(collection.id).all())
 
 @app.route('/book/<int:book_id>/add_to_collection', methods=['POST'])
 @login_required
 def add_book_to_collection(book_id):
-    user = User.query.get(session['user_id'])
-    if not user or user.role.name != 'пользователь':
+    if get_user_role() != 'пользователь':
         flash('Доступ запрещен')
         return redirect(url_for('book_detail', book_id=book_id))
     
@@ -645,9 +1494,8 @@ def add_book_to_collection(book_id):
         return redirect(url_for('book_detail', book_id=book_id))
     
     try:
-        collection_books_list = list(collection.books)
-        if book not in collection_books_list:
-            collection.books.append(book)
+        if not collection_has_book(collection.id, book.id):
+            db.session.execute(collection_books.insert().values(collection_id=collection.id, book_id=book.id))
             db.session.commit()
             flash(f'Книга добавлена в подборку "{collection.name}"')
         else:
@@ -668,12 +1516,12 @@ def remove_book_from_collection(collection_id, book_id):
         flash('Доступ запрещен')
         return redirect(url_for('my_collections'))
     
-    book = Book.query.get_or_404(book_id)
-    
     try:
-        collection_books_list = list(collection.books)
-        if book in collection_books_list:
-            collection.books.remove(book)
+        result = db.session.execute(collection_books.delete().where(
+            collection_books.c.collection_id == collection.id,
+            collection_books.c.book_id == book_id,
+        ))
+        if result.rowcount:
             db.session.commit()
             flash('Книга удалена из подборки')
         else:
@@ -685,16 +1533,81 @@ def remove_book_from_collection(collection_id, book_id):
     
     return redirect(url_for('collection_detail', collection_id=collection_id))
 
+def _book_id_set(value):
+    """Множество id из JSON-списка целых чисел или None, если пришло что-то другое"""
+    if not isinstance(value, list):
+        return None
+    # bool - подкласс int, но true/false идентификаторами книг не являются
+    if not all(isinstance(book_id, int) and not isinstance(book_id, bool) for book_id in value):
+        return None
+    return set(value)
+
+@app.route('/api/collections/<int:collection_id>/books', methods=['POST'])
+@login_required
+def api_update_collection_books(collection_id):
+    """Пакетно добавляет и удаляет книги подборки: {"add": [id, ...], "remove": [id, ...]}"""
+    if get_user_role() != 'пользователь':
+        return {'error': 'Access denied'}, 403
+    
+    collection = Collection.query.get_or_404(collection_id)
+    if collection.user_id != session['user_id']:
+        return {'error': 'Access denied'}, 403
+    
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return {'error': 'Expected a JSON object'}, 400
+    add_ids = _book_id_set(payload.get('add', []))
+    remove_ids = _book_id_set(payload.get('remove', []))
+    if add_ids is None or remove_ids is None:
+        return {'error': '"add" and "remove" must be lists of integer book ids'}, 400
+    if len(add_ids) + len(remove_ids) > COLLECTION_BATCH_LIMIT:
+        return {'error': f'At most {COLLECTION_BATCH_LIMIT} book ids per request'}, 400
+    
+    try:
+        added = []
+        if add_ids:
+            known = set(db.session.scalars(db.select(Book.id).where(Book.id.in_(add_ids))))
+            present = set(db.session.scalars(db.select(collection_books.c.book_id).where(
+                collection_books.c.collection_id == collection.id,
+                collection_books.c.book_id.in_(known),
+            )))
+            added = sorted(known - present)
+            if added:
+                db.session.execute(collection_books.insert(), [
+                    {'collection_id': collection.id, 'book_id': book_id} for book_id in added
+                ])
+            missing = sorted(add_ids - known)
+        else:
+            missing = []
+        
+        removed = 0
+        if remove_ids:
+            removed = db.session.execute(collection_books.delete().where(
+                collection_books.c.collection_id == collection.id,
+                collection_books.c.book_id.in_(remove_ids),
+            )).rowcount
+        
+        db.session.commit()
+        
+    except Exception as e:
+        db.session.rollback()
+        return {'error': 'Failed to update collection'}, 500
+    
+    return jsonify({'added': len(added), 'removed': removed, 'missing': missing})
+
 @app.route('/api/user_collections')
 @login_required
 def api_user_collections():
-    user = User.query.get(session['user_id'])
-    if not user or user.role.name != 'пользователь':
+    if get_user_role() != 'пользователь':
         return {'error': 'Access denied'}, 403
     
-    collections = Collection.query.filter_by(user_id=session['user_id']).all()
+    collections = db.session.execute(
+        db.select(Collection.id, Collection.name, Collection.book_count)
+        .where(Collection.user_id == session['user_id'])
+        .order_by(Collection.id)
+    ).all()
     
-    return jsonify([
+    response = jsonify([
         {
             'id': c.id,
             'name': c.name,
@@ -702,6 +1615,602 @@ def api_user_collections():
         }
         for c in collections
     ])
+    # Модальное окно запрашивает список при каждом открытии: отвечаем 304, если он не изменился
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+@app.route('/api/book/<int:book_id>/ratings')
+def api_book_ratings(book_id):
+    books = Book.__table__
+    row = db.session.execute(
+        db.select(books.c.rating_count, books.c.rating_avg, *(books.c[f'rating_{stars}'] for stars in RATING_STARS))
+        .where(books.c.id == book_id)
+    ).first()
+    if row is None:
+        abort(404)
+    response = jsonify({
+        'book_id': book_id,
+        'count': row.rating_count,
+        'average': round(row.rating_avg, 2) if row.rating_count else None,
+        'distribution': {str(stars): row._mapping[f'rating_{stars}'] for stars in RATING_STARS},
+    })
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+EXPORT_FIELDS = ('id', 'title', 'author', 'publisher', 'year', 'pages', 'genres', 'rating_count', 'rating_avg',
+                 *(f'rating_{stars}' for stars in RATING_STARS))
+EXPORT_BATCH_SIZE = 1000
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+def export_rows(batch_size=EXPORT_BATCH_SIZE):
+    """Книги с жанрами и агрегатами рейтинга; строки читаются серверным курсором пачками"""
+    books = Book.__table__
+    genres = Genre.__table__
+    # Жанры приходят тем же запросом, упорядоченным по книге: пока курсор MySQL
+    # не дочитан, другие запросы на этом соединении выполнять нельзя. Порядок только
+    # по books.id - его отдаёт первичный ключ без filesort, жанры сортируем здесь
+    query = (
+        db.select(*(books.c[name] for name in EXPORT_FIELDS if name != 'genres'), genres.c.name.label('genre'))
+        .select_from(
+            books.outerjoin(book_genres, book_genres.c.book_id == books.c.id)
+            .outerjoin(genres, genres.c.id == book_genres.c.genre_id)
+        )
+        .order_by(books.c.id)
+        .execution_options(yield_per=batch_size)
+    )
+    result = db.session.execute(query)
+    for _, group in itertools.groupby(result.mappings(), key=lambda row: row['id']):
+        group = list(group)
+        row = {name: group[0][name] for name in EXPORT_FIELDS if name != 'genres'}
+        row['genres'] = sorted(item['genre'] for item in group if item['genre'] is not None)
+        if row['rating_avg'] is not None:
+            row['rating_avg'] = round(row['rating_avg'], 2)
+        yield row
+
+def export_chunks(fmt, rows, rows_per_chunk=EXPORT_BATCH_SIZE):
+    """Сериализует строки в CSV или NDJSON кусками по rows_per_chunk строк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == 'csv':
+        writer.writerow(EXPORT_FIELDS)
+        # Заголовок отдаём сразу, не дожидаясь первой пачки
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    for batch in _batched(rows, rows_per_chunk):
+        for row in batch:
+            if fmt == 'csv':
+                writer.writerow([';'.join(row[name]) if name == 'genres' else row[name] for name in EXPORT_FIELDS])
+            else:
+                buffer.write(json.dumps(row, ensure_ascii=False) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+@app.route('/admin/export.<fmt>')
+@admin_required
+def export_catalog(fmt):
+    if fmt not in EXPORT_MIMETYPES:
+        abort(404)
+    response = Response(stream_with_context(export_chunks(fmt, export_rows())), mimetype=EXPORT_MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=books.{fmt}'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/metrics')
+def metrics():
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    return Response(request_metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/admin/pool')
+@admin_required
+def admin_pool_status():
+    # Счётчики относятся к текущему процессу (воркеру gunicorn)
+    return jsonify(pool_status(db.engine.pool))
+
+# CLI commands
+books_cli = AppGroup('books', help='Обслуживание каталога книг')
+
+def _review_aggregates():
+    reviews = Review.__table__
+    return (
+        db.select(
+            reviews.c.book_id,
+            db.func.count().label('cnt'),
+            db.func.sum(reviews.c.rating).label('total'),
+            *(db.func.sum(db.case((reviews.c.rating == stars, 1), else_=0)).label(f'stars_{stars}')
+              for stars in RATING_STARS),
+        )
+        .group_by(reviews.c.book_id)
+        .subquery()
+    )
+
+@books_cli.command('rebuild-ratings')
+@click.option('--check', is_flag=True, help='Только найти расхождения, ничего не изменяя')
+def rebuild_ratings(check):
+    """Пересчитывает агрегаты и гистограммы рейтингов книг по таблице reviews"""
+    books = Book.__table__
+    agg = _review_aggregates()
+    actual_count = db.func.coalesce(agg.c.cnt, 0)
+    actual_sum = db.func.coalesce(agg.c.total, 0)
+    stored_stars = [books.c[f'rating_{stars}'] for stars in RATING_STARS]
+    actual_stars = [db.func.coalesce(agg.c[f'stars_{stars}'], 0) for stars in RATING_STARS]
+    drift_query = (
+        db.select(books.c.id, books.c.rating_count, books.c.rating_sum, actual_count, actual_sum,
+                  *stored_stars, *actual_stars)
+        .select_from(books.outerjoin(agg, agg.c.book_id == books.c.id))
+        .where(db.or_(
+            books.c.rating_count != actual_count,
+            books.c.rating_sum != actual_sum,
+            *(stored != actual for stored, actual in zip(stored_stars, actual_stars)),
+        ))
+    )
+    drifted = db.session.scalar(db.select(db.func.count()).select_from(drift_query.subquery()))
+    
+    for row in db.session.execute(drift_query.order_by(books.c.id).limit(20)):
+        book_id, stored_count, stored_sum, real_count, real_sum = row[:5]
+        stored_histogram = '/'.join(map(str, row[5:10]))
+        real_histogram = '/'.join(map(str, row[10:15]))
+        click.echo(f'Книга {book_id}: сохранено {stored_count}/{stored_sum} [{stored_histogram}], '
+                   f'по рецензиям {real_count}/{real_sum} [{real_histogram}]')
+    click.echo(f'Книг с расхождениями: {drifted}')
+    
+    if check:
+        if drifted:
+            raise SystemExit(1)
+        return
+    
+    reviews = Review.__table__
+    count_sq = db.select(db.func.count()).where(reviews.c.book_id == books.c.id).scalar_subquery()
+    sum_sq = db.select(db.func.coalesce(db.func.sum(reviews.c.rating), 0)).where(reviews.c.book_id == books.c.id).scalar_subquery()
+    avg_sq = db.select(db.func.avg(reviews.c.rating)).where(reviews.c.book_id == books.c.id).scalar_subquery()
+    stars_sq = {
+        f'rating_{stars}': db.select(db.func.count())
+        .where(reviews.c.book_id == books.c.id, reviews.c.rating == stars).scalar_subquery()
+        for stars in RATING_STARS
+    }
+    db.session.execute(books.update().values(rating_count=count_sq, rating_sum=sum_sq, rating_avg=avg_sq, **stars_sq))
+    db.session.commit()
+    bump_page_versions_from_command('catalog', 'shared')
+    click.echo('Агрегаты рейтингов пересчитаны')
+
+def _read_import_records(path, fmt):
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                row['genres'] = [name.strip() for name in (row.get('genres') or '').split(';') if name.strip()]
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+class _CatalogImporter:
+    """Вставляет книги пачками в обход ORM, поддерживая то, что обычно делают события моделей"""
+    
+    def __init__(self, covers_dir):
+        self.covers_dir = covers_dir
+        self.genres = dict(db.session.execute(db.select(Genre.name, Genre.id)).all())
+        self.books = Book.__table__
+        self.covers = Cover.__table__
+        self.returning = db.engine.dialect.insert_executemany_returning_sort_by_parameter_order
+    
+    def genre_ids(self, names):
+        ids = []
+        for name in names:
+            if name not in self.genres:
+                self.genres[name] = db.session.execute(
+                    Genre.__table__.insert().values(name=name)
+                ).inserted_primary_key[0]
+            ids.append(self.genres[name])
+        return ids
+    
+    def prepare(self, record):
+        """Строка books без cover_id и список жанров; ValueError для негодной записи"""
+        row = {
+            'title': record['title'].strip(),
+            'author': record['author'].strip(),
+            'publisher': record['publisher'].strip(),
+            'year': int(record['year']),
+            'pages': int(record['pages']),
+            'description': sanitize_html(record.get('description') or ''),
+        }
+        if not all((row['title'], row['author'], row['publisher'])):
+            raise ValueError('пустое название, автор или издательство')
+        row['description_html'] = render_markdown(row['description'])
+        row['description_html_version'] = DESCRIPTION_RENDERER_VERSION
+        cover = record.get('cover')
+        if not cover:
+            raise ValueError('не указана обложка')
+        return row, os.path.join(self.covers_dir, cover), record.get('genres') or []
+    
+    def resolve_covers(self, cover_paths):
+        """Возвращает {путь: cover_id}, добавляя только обложки с новым MD5"""
+        staged = {}
+        for path in set(cover_paths):
+            with open(path, 'rb') as f:
+                staged[path] = stream_to_temp(f)
+        
+        hashes = {cover_hash for _, cover_hash in staged.values()}
+        known = dict(db.session.execute(
+            db.select(self.covers.c.md5_hash, self.covers.c.id).where(self.covers.c.md5_hash.in_(hashes))
+        ).all())
+        
+        result = {}
+        for path, (tmp_path, cover_hash) in staged.items():
+            if cover_hash not in known:
+                extension = path.rsplit('.', 1)[-1].lower() if '.' in os.path.basename(path) else 'jpg'
+                filename = cover_storage_path(cover_hash, extension)
+                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                os.replace(tmp_path, file_path)
+                known[cover_hash] = db.session.execute(self.covers.insert().values(
+                    filename=filename,
+                    mime_type=mimetypes.guess_type(path)[0] or 'image/jpeg',
+                    md5_hash=cover_hash,
+                )).inserted_primary_key[0]
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            result[path] = known[cover_hash]
+        return result
+    
+    def insert_books(self, rows):
+        if self.returning:
+            return list(db.session.scalars(
+                self.books.insert().returning(self.books.c.id, sort_by_parameter_order=True), rows
+            ))
+        # MySQL не умеет RETURNING для executemany: id получаем построчно
+        return [db.session.execute(self.books.insert().values(**row)).inserted_primary_key[0] for row in rows]
+    
+    def import_batch(self, batch):
+        prepared = []
+        for number, record in batch:
+            try:
+                prepared.append(self.prepare(record))
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                click.echo(f'Запись {number} пропущена: {e}', err=True)
+        
+        cover_ids = self.resolve_covers([path for _, path, _ in prepared if os.path.isfile(path)])
+        rows, genre_lists = [], []
+        for row, cover_path, genres in prepared:
+            if cover_path not in cover_ids:
+                click.echo(f'Книга "{row["title"]}" пропущена: нет файла обложки {cover_path}', err=True)
+                continue
+            rows.append({**row, 'cover_id': cover_ids[cover_path]})
+            genre_lists.append(self.genre_ids(genres))
+        if not rows:
+            return 0
+        
+        book_ids = self.insert_books(rows)
+        links = [
+            {'book_id': book_id, 'genre_id': genre_id}
+            for book_id, genre_ids in zip(book_ids, genre_lists)
+            for genre_id in dict.fromkeys(genre_ids)
+        ]
+        if links:
+            db.session.execute(book_genres.insert(), links)
+        
+        refs = collections.Counter(row['cover_id'] for row in rows)
+        db.session.execute(
+            self.covers.update().where(self.covers.c.id == db.bindparam('cover'))
+            .values(ref_count=self.covers.c.ref_count + db.bindparam('refs')),
+            [{'cover': cover_id, 'refs': count} for cover_id, count in refs.items()],
+        )
+        search.index_rows(db.session.connection(), [{**row, 'id': book_id} for row, book_id in zip(rows, book_ids)])
+        return len(rows)
+
+@books_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='По умолчанию - по расширению файла')
+@click.option('--covers-dir', type=click.Path(file_okay=False), help='Откуда брать файлы обложек (по умолчанию - каталог файла)')
+@click.option('--batch-size', default=500, show_default=True, help='Записей в одном executemany')
+@click.option('--commit-every', default=5000, show_default=True, help='Записей между коммитами')
+@click.option('--restart', is_flag=True, help='Начать сначала, игнорируя сохранённое смещение')
+def import_books(path, fmt, covers_dir, batch_size, commit_every, restart):
+    """Импортирует каталог книг из CSV или JSONL (поля title, author, publisher, year, pages,
+    description, genres, cover)"""
+    fmt = fmt or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    source = os.path.abspath(path)
+    progress = db.session.get(ImportProgress, source) or ImportProgress(source=source, offset=0)
+    if restart:
+        progress.offset = 0
+    db.session.add(progress)
+    start = progress.offset
+    if start:
+        click.echo(f'Продолжаем с записи {start}')
+    
+    importer = _CatalogImporter(covers_dir or os.path.dirname(source))
+    records = enumerate(_read_import_records(path, fmt))
+    imported = 0
+    since_commit = 0
+    started_at = time.monotonic()
+    
+    for batch in _batched(itertools.islice(records, start, None), batch_size):
+        imported += importer.import_batch(batch)
+        since_commit += len(batch)
+        progress.offset = batch[-1][0] + 1
+        if since_commit >= commit_every:
+            db.session.commit()
+            since_commit = 0
+            rate = (progress.offset - start) / max(time.monotonic() - started_at, 1e-6)
+            click.echo(f'Обработано записей: {progress.offset}, добавлено книг: {imported} ({rate:.0f} зап./с)')
+    
+    db.session.commit()
+    _catalog_count_cache.clear()
+    # Книги и жанры вставлялись в обход ORM
+    genre_registry.invalidate()
+    bump_page_versions_from_command('catalog', 'shared')
+    click.echo(f'Импорт завершён: обработано записей {progress.offset}, добавлено книг {imported}')
+
+@books_cli.command('render-descriptions')
+@click.option('--all', 'render_all', is_flag=True, help='Перерисовать все описания, а не только устаревшие')
+@click.option('--batch-size', default=500, show_default=True)
+def render_descriptions(render_all, batch_size):
+    """Заново рендерит HTML описаний книг"""
+    rendered = 0
+    last_id = 0
+    while True:
+        query = Book.query.filter(Book.id > last_id)
+        if not render_all:
+            query = query.filter(Book.description_html_version != DESCRIPTION_RENDERER_VERSION)
+        batch = query.options(db.load_only(Book.id, Book.description)).order_by(Book.id).limit(batch_size).all()
+        if not batch:
+            break
+        for book in batch:
+            book.render_description()
+        last_id = batch[-1].id
+        rendered += len(batch)
+        db.session.commit()
+        click.echo(f'Обработано описаний: {rendered}')
+    click.echo(f'Готово, перерисовано описаний: {rendered}')
+
+@books_cli.command('reindex-search')
+def reindex_search():
+    """Перестраивает полнотекстовый индекс книг"""
+    search.rebuild(db.session.connection(), Book.__table__)
+    db.session.commit()
+    click.echo('Поисковый индекс перестроен')
+
+@books_cli.command('recommend')
+@click.option('--full', is_flag=True, help='Пересчитать все книги, а не только затронутые новыми рецензиями')
+@click.option('--top-k', default=SIMILAR_BOOKS_TOP_K, show_default=True, help='Похожих книг, сохраняемых для каждой книги')
+@click.option('--batch-size', default=1000, show_default=True, help='Книг в одном умножении матриц')
+def recommend_books(full, top_k, batch_size):
+    """Пересчитывает похожие книги (book_similar) по оценкам читателей
+
+    Без --full пересчитываются только книги, которых касаются рецензии, добавленные
+    с прошлого запуска; удалённые рецензии учитывает только полный пересчёт.
+    """
+    # numpy и scipy нужны только этой офлайн-команде, а не веб-процессу
+    from recommendations import RatingMatrix, affected_books
+    
+    # Время фиксируем до чтения оценок: рецензии, добавленные во время расчёта,
+    # попадут в следующий инкрементальный запуск
+    started_at = datetime.utcnow()
+    last_run = db.session.scalars(
+        db.select(RecommendationRun).order_by(RecommendationRun.id.desc()).limit(1)
+    ).first()
+    full = full or last_run is None
+    
+    user_ids, book_ids, ratings = [], [], []
+    reviews = Review.__table__
+    rows = db.session.execute(
+        db.select(reviews.c.user_id, reviews.c.book_id, reviews.c.rating).execution_options(yield_per=10000)
+    )
+    for user_id, book_id, rating in rows:
+        user_ids.append(user_id)
+        book_ids.append(book_id)
+        ratings.append(rating)
+    matrix = RatingMatrix(user_ids, book_ids, ratings) if ratings else None
+    click.echo(f'Оценок: {len(ratings)}, книг с оценками: {len(matrix.book_ids) if matrix else 0}')
+    
+    similar = BookSimilar.__table__
+    connection = db.session.connection()
+    if full:
+        connection.execute(similar.delete())
+        targets = matrix.book_ids if matrix else []
+        updated = len(targets)
+    else:
+        changed = set(db.session.scalars(
+            db.select(Review.book_id).where(Review.created_at >= last_run.started_at).distinct()
+        ))
+        current = collections.defaultdict(list)
+        for row in connection.execute(db.select(similar).order_by(similar.c.book_id, similar.c.rank)):
+            current[row.book_id].append((row.similar_book_id, row.score))
+        affected = affected_books(matrix, changed, current, top_k) if matrix and changed else set(changed)
+        for batch in _batched(sorted(affected), 500):
+            connection.execute(similar.delete().where(similar.c.book_id.in_(batch)))
+        targets = sorted(affected)
+        updated = len(affected)
+    
+    if matrix is not None and len(targets):
+        neighbours = matrix.neighbours(matrix.columns(targets), top_k, batch_size)
+        for batch in _batched(neighbours, batch_size):
+            values = [
+                {'book_id': book_id, 'rank': rank, 'similar_book_id': similar_id, 'score': score}
+                for book_id, neighbours_of_book in batch
+                for rank, (similar_id, score) in enumerate(neighbours_of_book)
+            ]
+            if values:
+                connection.execute(similar.insert(), values)
+    
+    db.session.add(RecommendationRun(started_at=started_at, full=full, books_updated=updated))
+    db.session.commit()
+    if full:
+        bump_page_versions_from_command('shared')
+    else:
+        bump_page_versions_from_command(*(f'book:{book_id}' for book_id in targets))
+    click.echo(f'Похожие книги пересчитаны ({"полностью" if full else "инкрементально"}), книг: {updated}')
+
+@books_cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(sorted(EXPORT_MIMETYPES)), default='ndjson', show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Файл (по умолчанию - stdout)')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help='Строк, читаемых с сервера за раз')
+def export_books(fmt, output, batch_size):
+    """Выгружает книги, их жанры и агрегаты рейтинга в CSV или NDJSON"""
+    for chunk in export_chunks(fmt, export_rows(batch_size), batch_size):
+        output.write(chunk)
+
+covers_cli = AppGroup('covers', help='Обслуживание хранилища обложек')
+
+@covers_cli.command('recount')
+def recount_covers():
+    """Пересчитывает covers.ref_count по таблице books"""
+    covers = Cover.__table__
+    books = Book.__table__
+    refs = db.select(db.func.count()).where(books.c.cover_id == covers.c.id).scalar_subquery()
+    result = db.session.execute(covers.update().where(covers.c.ref_count != refs).values(ref_count=refs))
+    db.session.commit()
+    click.echo(f'Исправлено счётчиков: {result.rowcount}')
+
+@covers_cli.command('relayout')
+@click.option('--batch-size', default=500, show_default=True)
+def relayout_covers(batch_size):
+    """Переносит обложки из старой схемы <id>.<ext> в ab/cd/<md5>.<ext>"""
+    moved = 0
+    last_id = 0
+    while True:
+        batch = (Cover.query.filter(Cover.id > last_id, Cover.filename.notlike('%/%'))
+                 .order_by(Cover.id).limit(batch_size).all())
+        if not batch:
+            break
+        for cover in batch:
+            last_id = cover.id
+            old_path = os.path.join(app.config['UPLOAD_FOLDER'], cover.filename)
+            if not os.path.exists(old_path):
+                continue
+            extension = cover.filename.rsplit('.', 1)[-1].lower() if '.' in cover.filename else 'jpg'
+            new_filename = cover_storage_path(cover.md5_hash, extension)
+            new_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
+            os.makedirs(os.path.dirname(new_path), exist_ok=True)
+            os.replace(old_path, new_path)
+            cover.filename = new_filename
+            moved += 1
+        db.session.commit()
+    click.echo(f'Перенесено обложек: {moved}')
+
+def _scan_files(root, relative='', skip=()):
+    """Обходит дерево через os.scandir, не собирая списков в памяти"""
+    with os.scandir(os.path.join(root, relative)) as entries:
+        for entry in entries:
+            path = f'{relative}/{entry.name}' if relative else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if path not in skip:
+                    yield from _scan_files(root, path, skip)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry, path
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@covers_cli.command('gc')
+@click.option('--dry-run', is_flag=True, help='Только показать, что было бы удалено')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--min-age', default=3600, show_default=True,
+              help='Не трогать файлы моложе стольких секунд (незавершённые загрузки)')
+def gc_covers(dry_run, batch_size, min_age):
+    """Удаляет файлы обложек без записей и записи обложек без книг"""
+    upload_folder = app.config['UPLOAD_FOLDER']
+    cutoff = time.time() - min_age
+    covers = Cover.__table__
+    books = Book.__table__
+    stats = {'files': 0, 'variants': 0, 'rows': 0, 'missing': 0}
+    
+    def remove_file(path):
+        click.echo(f'Лишний файл: {path}')
+        stats['files'] += 1
+        if not dry_run:
+            os.remove(os.path.join(upload_folder, path))
+    
+    # 1. Файлы без записей в covers
+    originals = (
+        (entry, path) for entry, path in _scan_files(upload_folder, skip=(VARIANTS_DIRNAME,))
+        if entry.stat().st_mtime < cutoff
+    )
+    for batch in _batched(originals, batch_size):
+        paths = [path for _, path in batch if not os.path.basename(path).startswith(UPLOAD_TMP_PREFIX)]
+        known = set(db.session.scalars(db.select(covers.c.filename).where(covers.c.filename.in_(paths))))
+        for _, path in batch:
+            if path not in known:
+                remove_file(path)
+    
+    # 2. Каталоги вариантов обложек, которых больше нет
+    variant_root = os.path.join(upload_folder, VARIANTS_DIRNAME)
+    if os.path.isdir(variant_root):
+        # scandir отдаёт файлы одного каталога подряд, groupby схлопывает их в ключ
+        keys = (
+            key for key, files in itertools.groupby(
+                _scan_files(variant_root), key=lambda item: os.path.basename(os.path.dirname(item[1]))
+            )
+            if all(entry.stat().st_mtime < cutoff for entry, _ in files)
+        )
+        for batch in _batched(keys, batch_size):
+            known = set(db.session.scalars(db.select(covers.c.md5_hash).where(covers.c.md5_hash.in_(batch))))
+            for key in set(batch) - known:
+                click.echo(f'Лишние варианты: {key}')
+                stats['variants'] += 1
+                if not dry_run:
+                    remove_variants(upload_folder, key)
+    
+    # 3. Записи covers без книг и записи без файлов, пачками по id
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            db.select(covers.c.id, covers.c.filename, covers.c.md5_hash)
+            .where(covers.c.id > last_id).order_by(covers.c.id).limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        ids = [row.id for row in batch]
+        referenced = set(db.session.scalars(
+            db.select(books.c.cover_id).where(books.c.cover_id.in_(ids)).distinct()
+        ))
+        dangling = [row for row in batch if row.id not in referenced]
+        for row in batch:
+            if row.id in referenced and not os.path.exists(os.path.join(upload_folder, row.filename)):
+                click.echo(f'Нет файла у обложки {row.id}: {row.filename}')
+                stats['missing'] += 1
+        for row in dangling:
+            click.echo(f'Обложка без книг: {row.id}')
+        stats['rows'] += len(dangling)
+        
+        if dangling and not dry_run:
+            dangling_ids = [row.id for row in dangling]
+            db.session.execute(covers.delete().where(
+                covers.c.id.in_(dangling_ids),
+                ~db.exists().where(books.c.cover_id == covers.c.id),
+            ))
+            db.session.commit()
+            # Обложку могли успеть назначить книге: её строка и файл остаются
+            kept = set(db.session.scalars(db.select(covers.c.id).where(covers.c.id.in_(dangling_ids))))
+            for row in dangling:
+                if row.id in kept:
+                    continue
+                file_path = os.path.join(upload_folder, row.filename)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                remove_variants(upload_folder, row.md5_hash)
+    
+    prefix = 'Найдено' if dry_run else 'Удалено'
+    click.echo(f"{prefix}: файлов {stats['files']}, каталогов вариантов {stats['variants']}, "
+               f"записей {stats['rows']}; обложек без файла: {stats['missing']}")
+
+app.cli.add_command(books_cli)
+app.cli.add_command(covers_cli)
 
 if __name__ == '__main__':
     with app.app_context():
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный стенд: синтетическая библиотека в SQLite и замер основных страниц
+
+    python benchmark.py --books 50000 --reviews 1000000 --collections 100000 \
+        --concurrency 8 --requests 2000 --output current.json --baseline baseline.json
+
+Библиотека заполняется один раз и переиспользуется, пока не изменятся
+параметры заполнения. Результат - JSON с перцентилями задержки, пропускной
+способностью и числом SQL-запросов по каждому endpoint; с --baseline
+печатается сравнение с прошлым прогоном.
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BENCH_PASSWORD = 'bench123'
+BENCH_USERNAME = 'bench'
+SEED_BATCH = 10000
+COVER_COUNT = 50
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный стенд электронной библиотеки')
+    parser.add_argument('--db', default=os.path.join('instance', 'benchmark.db'), help='Файл SQLite')
+    parser.add_argument('--books', type=int, default=50000)
+    parser.add_argument('--reviews', type=int, default=1000000)
+    parser.add_argument('--collections', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--books-per-collection', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1, help='Зерно генератора данных и запросов')
+    parser.add_argument('--reseed', action='store_true', help='Заполнить базу заново')
+    parser.add_argument('--mode', choices=['client', 'server'], default='client',
+                        help='Flask test client или локальный многопоточный сервер')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help='Запросов на endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='Неучитываемых запросов на endpoint')
+    parser.add_argument('--endpoints', help='Через запятую; по умолчанию все')
+    parser.add_argument('--output', help='Куда записать JSON (по умолчанию - stdout)')
+    parser.add_argument('--baseline', help='JSON прошлого прогона для сравнения')
+    return parser.parse_args(argv)
+
+
+def seed_params(args):
+    return {
+        'books': args.books,
+        'reviews': args.reviews,
+        'collections': args.collections,
+        'users': args.users,
+        'books_per_collection': args.books_per_collection,
+        'seed': args.seed,
+    }
+
+
+# Заполнение базы
+
+def _cover_images(count, rng):
+    from PIL import Image
+    for _ in range(count):
+        buffer = io.BytesIO()
+        color = tuple(rng.randrange(256) for _ in range(3))
+        Image.new('RGB', (600, 800), color).save(buffer, 'JPEG', quality=80)
+        yield buffer.getvalue()
+
+
+def seed_library(params, upload_folder, log=print):
+    """Заполняет пустую базу приложения синтетической библиотекой в обход ORM"""
+    import hashlib
+    import search
+    from app import (db, Role, User, Genre, Cover, Book, Review, Collection, book_genres,
+                     collection_books, cover_storage_path, render_markdown, DESCRIPTION_RENDERER_VERSION)
+
+    rng = random.Random(params['seed'])
+    started = time.monotonic()
+    connection = db.session.connection()
+    execute = connection.execute
+
+    execute(Role.__table__.insert(), [
+        {'id': 1, 'name': 'администратор', 'description': 'Полный доступ'},
+        {'id': 2, 'name': 'модератор', 'description': 'Редактирование книг'},
+        {'id': 3, 'name': 'пользователь', 'description': 'Рецензии и подборки'},
+    ])
+    # Хеш пароля считается один раз: у всех пользователей стенда один пароль
+    bench_user = User(username=BENCH_USERNAME)
+    bench_user.set_password(BENCH_PASSWORD)
+    users = params['users']
+    for start in range(1, users + 1, SEED_BATCH):
+        execute(User.__table__.insert(), [
+            {'id': user_id, 'username': BENCH_USERNAME if user_id == 1 else f'user{user_id}',
+             'password_hash': bench_user.password_hash, 'first_name': 'Читатель',
+             'last_name': str(user_id), 'role_id': 3}
+            for user_id in range(start, min(start + SEED_BATCH, users + 1))
+        ])
+
+    genre_names = ['Проза', 'Поэзия', 'Фантастика', 'Детектив', 'Роман', 'История', 'Наука', 'Детская', 'Драма', 'Фэнтези']
+    execute(Genre.__table__.insert(), [{'id': i, 'name': name} for i, name in enumerate(genre_names, 1)])
+
+    cover_rows = []
+    for cover_id, data in enumerate(_cover_images(COVER_COUNT, rng), 1):
+        md5_hash = hashlib.md5(data).hexdigest()
+        filename = cover_storage_path(md5_hash, 'jpg')
+        path = os.path.join(upload_folder, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        cover_rows.append({'id': cover_id, 'filename': filename, 'mime_type': 'image/jpeg',
+                           'md5_hash': md5_hash, 'ref_count': 0})
+
+    description = 'Синтетическое **описание** книги для нагрузочного стенда.\n\n' * 3
+    description_html = render_markdown(description)
+    books, reviews_total = params['books'], params['reviews']
+    per_book, extra = divmod(reviews_total, books)
+    per_book = min(per_book, users)
+    epoch = datetime(2015, 1, 1)
+    review_id = 0
+
+    for start in range(1, books + 1, SEED_BATCH):
+        book_rows, genre_rows, review_rows = [], [], []
+        for book_id in range(start, min(start + SEED_BATCH, books + 1)):
+            cover = cover_rows[book_id % COVER_COUNT]
+            cover['ref_count'] += 1
+            count = min(per_book + (1 if book_id <= extra else 0), users)
+            ratings = [rng.randint(1, 5) for _ in range(count)]
+            for user_id, rating in zip(rng.sample(range(1, users + 1), count), ratings):
+                review_id += 1
+                review_rows.append({
+                    'id': review_id, 'book_id': book_id, 'user_id': user_id, 'rating': rating,
+                    'text': 'Синтетическая рецензия', 'created_at': epoch + timedelta(minutes=rng.randrange(5_000_000)),
+                })
+            book_rows.append({
+                'id': book_id, 'title': f'Книга {book_id}', 'description': description,
+                'description_html': description_html, 'description_html_version': DESCRIPTION_RENDERER_VERSION,
+                'year': rng.randint(1900, 2024), 'publisher': f'Издательство {book_id % 200}',
+                'author': f'Автор {book_id % 5000}', 'pages': rng.randint(50, 1200), 'cover_id': cover['id'],
+                'rating_sum': sum(ratings), 'rating_count': count,
+                'rating_avg': sum(ratings) / count if count else None,
+                **{f'rating_{stars}': ratings.count(stars) for stars in range(1, 6)},
+            })
+            for genre_id in rng.sample(range(1, len(genre_names) + 1), rng.randint(1, 3)):
+                genre_rows.append({'book_id': book_id, 'genre_id': genre_id})
+        if start == 1:
+            execute(Cover.__table__.insert(), cover_rows)
+        execute(Book.__table__.insert(), book_rows)
+        execute(book_genres.insert(), genre_rows)
+        if review_rows:
+            execute(Review.__table__.insert(), review_rows)
+        log(f'Книг: {book_rows[-1]["id"]}, рецензий: {review_id}')
+
+    covers = Cover.__table__
+    execute(covers.update().where(covers.c.id == db.bindparam('cover')).values(ref_count=db.bindparam('refs')),
+            [{'cover': row['id'], 'refs': row['ref_count']} for row in cover_rows])
+
+    collection_count = params['collections']
+    for start in range(1, collection_count + 1, SEED_BATCH):
+        collection_rows, link_rows = [], []
+        for collection_id in range(start, min(start + SEED_BATCH, collection_count + 1)):
+            # Первые 20 подборок принадлежат пользователю стенда
+            owner = 1 if collection_id <= 20 else rng.randint(1, users)
+            collection_rows.append({'id': collection_id, 'name': f'Подборка {collection_id}', 'user_id': owner,
+                                    'created_at': epoch + timedelta(minutes=collection_id)})
+            for book_id in rng.sample(range(1, books + 1), min(params['books_per_collection'], books)):
+                link_rows.append({'collection_id': collection_id, 'book_id': book_id})
+        execute(Collection.__table__.insert(), collection_rows)
+        execute(collection_books.insert(), link_rows)
+        log(f'Подборок: {collection_rows[-1]["id"]}')
+
+    search.rebuild(connection, Book.__table__)
+    db.session.commit()
+    log(f'База заполнена за {time.monotonic() - started:.1f} с')
+
+
+def prepare_database(args, log=print):
+    """Создаёт или переиспользует базу стенда; возвращает (app, db)"""
+    db_path = os.path.abspath(args.db)
+    meta_path = db_path + '.json'
+    params = seed_params(args)
+    fresh = args.reseed or not os.path.exists(db_path)
+    if not fresh:
+        with open(meta_path, encoding='utf-8') as f:
+            fresh = json.load(f) != params
+    if fresh:
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        for path in (db_path, meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    # Настройки читаются при импорте приложения
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ['QUERY_COUNT_HEADER'] = '1'
+    os.environ.setdefault('RESPONSE_CACHE', 'off')
+    # Все потоки входят под одним логином с одного адреса
+    os.environ.setdefault('LOGIN_RATE_LIMIT', 'off')
+    from app import app, db
+
+    app.config['UPLOAD_FOLDER'] = db_path + '-uploads'
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with app.app_context():
+        if fresh:
+            db.create_all()
+            seed_library(params, app.config['UPLOAD_FOLDER'], log)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(params, f)
+    return app, db
+
+
+# Нагрузка
+
+def endpoints(params):
+    """name -> (нужен ли вход, функция rng -> путь)"""
+    books = params['books']
+    pages = max(1, books // 10)
+    return {
+        'index': (False, lambda rng: f'/?page={rng.randint(1, pages)}'),
+        'book_detail': (False, lambda rng: f'/book/{rng.randint(1, books)}'),
+        'serve_cover': (False, lambda rng: f'/cover/{rng.randint(1, min(COVER_COUNT, books))}?size=card'),
+        'my_collections': (True, lambda rng: '/collections'),
+        'api_user_collections': (True, lambda rng: '/api/user_collections'),
+    }
+
+
+class TestClientTransport:
+    def __init__(self, app, login):
+        self.client = app.test_client()
+        if login:
+            self.client.post('/login', data={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD})
+
+    def get(self, path):
+        response = self.client.get(path)
+        response.get_data()
+        return response.status_code, response.headers.get('X-Query-Count')
+
+
+class HTTPTransport:
+    def __init__(self, host, port, login):
+        self.host, self.port = host, port
+        self.cookie = None
+        if login:
+            body = f'username={BENCH_USERNAME}&password={BENCH_PASSWORD}'
+            status, headers = self._request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+            self.cookie = headers.get('Set-Cookie', '').split(';', 1)[0]
+
+    def _request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status, response.headers
+        finally:
+            connection.close()
+
+    def get(self, path):
+        status, headers = self._request('GET', path)
+        return status, headers.get('X-Query-Count')
+
+
+def percentile(sorted_values, q):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples, wall_time):
+    latencies = sorted(latency for latency, _, _ in samples)
+    queries = [int(count) for _, _, count in samples if count is not None]
+    errors = sum(1 for _, status, _ in samples if status >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput_rps': round(len(samples) / wall_time, 1) if wall_time else None,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2),
+        },
+        'queries': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+    }
+
+
+def run_endpoint(make_transport, login, path_for, requests, warmup, concurrency, seed):
+    """Гоняет один endpoint из concurrency потоков; у каждого потока свой транспорт"""
+    # Вход (хеширование пароля) не должен попадать в замер
+    transports = [make_transport(login) for _ in range(concurrency)]
+    counter = iter(range(requests + warmup))
+    counter_lock = threading.Lock()
+    samples = []
+
+    def worker(worker_id):
+        transport = transports[worker_id]
+        rng = random.Random(seed * 1000 + worker_id)
+        results = []
+        while True:
+            with counter_lock:
+                number = next(counter, None)
+            if number is None:
+                return results
+            path = path_for(rng)
+            started = time.perf_counter()
+            status, query_count = transport.get(path)
+            if number >= warmup:
+                results.append((time.perf_counter() - started, status, query_count))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        for results in executor.map(worker, range(concurrency)):
+            samples.extend(results)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_benchmark(app, params, mode='client', concurrency=8, requests=500, warmup=20, names=None, seed=1, log=print):
+    server = None
+    if mode == 'server':
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        make_transport = lambda login: HTTPTransport('127.0.0.1', server.server_port, login)
+    else:
+        make_transport = lambda login: TestClientTransport(app, login)
+
+    results = {}
+    try:
+        for name, (login, path_for) in endpoints(params).items():
+            if names and name not in names:
+                continue
+            results[name] = run_endpoint(make_transport, login, path_for, requests, warmup, concurrency, seed)
+            latency = results[name]['latency_ms']
+            log(f'{name}: p50 {latency["p50"]} мс, p95 {latency["p95"]} мс, {results[name]["throughput_rps"]} зап./с')
+    finally:
+        if server is not None:
+            server.shutdown()
+    return {
+        'seed': params,
+        'run': {'mode': mode, 'concurrency': concurrency, 'requests': requests, 'warmup': warmup},
+        'endpoints': results,
+    }
+
+
+def compare(current, baseline):
+    """Строки сравнения с прошлым прогоном: изменение в процентах по каждой метрике"""
+    lines = []
+    for name, result in current['endpoints'].items():
+        old = baseline.get('endpoints', {}).get(name)
+        if not old:
+            lines.append(f'{name}: нет в базовом прогоне')
+            continue
+        parts = []
+        for label, new_value, old_value in (
+            ('p50', result['latency_ms']['p50'], old['latency_ms']['p50']),
+            ('p95', result['latency_ms']['p95'], old['latency_ms']['p95']),
+            ('p99', result['latency_ms']['p99'], old['latency_ms']['p99']),
+            ('rps', result['throughput_rps'], old['throughput_rps']),
+            ('queries', result['queries']['mean'], old['queries']['mean']),
+        ):
+            if new_value is None or not old_value:
+                continue
+            parts.append(f'{label} {old_value} -> {new_value} ({(new_value - old_value) / old_value * 100:+.1f}%)')
+        lines.append(f'{name}: ' + ', '.join(parts))
+    return lines
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log = lambda message: print(message, file=sys.stderr)
+    app, _ = prepare_database(args, log)
+    names = set(args.endpoints.split(',')) if args.endpoints else None
+    report = run_benchmark(app, seed_params(args), args.mode, args.concurrency, args.requests,
+                           args.warmup, names, args.seed, log)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            for line in compare(report, json.load(f)):
+                log(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверка планов основных запросов страниц: EXPLAIN для каждого и ошибка,
+если хоть один читает таблицу целиком.
+
+Запускать на базе с реальными (или похожими по объёму) данными: на почти
+пустых таблицах MySQL честно выбирает полный просмотр.
+"""
+
+import re
+import sys
+from datetime import datetime
+
+from app import (
+    app, db, book_genres, CATALOG_ORDER, catalog_query, keyset_query, review_page_query, similar_books_query,
+    search_queries, user_collections_query, collection_books_query,
+)
+
+# Значения параметров не важны для плана, важны только их типы
+SAMPLE_ID = 1
+SAMPLE_YEAR = 2000
+SAMPLE_TIME = datetime(2000, 1, 1)
+SAMPLE_QUERY = 'книга'
+PER_PAGE = 10
+
+
+def _statement(query):
+    # Query маршрута -> SELECT; готовые select() возвращаются как есть
+    return getattr(query, 'statement', query)
+
+
+def route_queries(connection):
+    """(название, SELECT) - запросы страниц, построенные теми же функциями, что и в маршрутах"""
+    queries = [
+        ('index: страница каталога',
+         catalog_query().order_by(*CATALOG_ORDER).limit(PER_PAGE).offset(PER_PAGE)),
+        ('index: первая keyset-страница', keyset_query(catalog_query(), None, PER_PAGE)),
+        ('index: следующая keyset-страница',
+         keyset_query(catalog_query(), ((SAMPLE_YEAR, SAMPLE_ID), 'next'), PER_PAGE)),
+        ('index: предыдущая keyset-страница',
+         keyset_query(catalog_query(), ((SAMPLE_YEAR, SAMPLE_ID), 'prev'), PER_PAGE)),
+        # Так selectinload(Book.genres) догружает жанры страницы
+        ('index: жанры книг страницы',
+         db.select(book_genres.c.book_id, book_genres.c.genre_id).where(book_genres.c.book_id.in_([SAMPLE_ID, SAMPLE_ID + 1]))),
+        ('book_detail: рецензии и своя рецензия', review_page_query(SAMPLE_ID, None, SAMPLE_ID)),
+        ('book_detail: следующая страница рецензий',
+         review_page_query(SAMPLE_ID, ((SAMPLE_TIME, SAMPLE_ID), 'next'), SAMPLE_ID)),
+        ('book_detail: рецензии для гостя', review_page_query(SAMPLE_ID, None, None)),
+        ('book_detail: похожие книги', similar_books_query(SAMPLE_ID)),
+        ('my_collections: подборки пользователя', user_collections_query(SAMPLE_ID)),
+        ('collection_detail: книги подборки', collection_books_query(SAMPLE_ID)),
+    ]
+    results, facets = search_queries(connection, SAMPLE_QUERY, [SAMPLE_ID], SAMPLE_YEAR, None, 2, PER_PAGE)
+    queries += [('search: результаты с фильтрами', results), ('search: счётчики по жанрам', facets)]
+    return [(name, _statement(query)) for name, query in queries]
+
+
+def _sql(connection, statement):
+    return str(statement.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def full_scans(connection, statement):
+    """Таблицы, которые запрос читает целиком"""
+    tables = set(db.metadata.tables)
+    sql = _sql(connection, statement)
+    if connection.dialect.name == 'sqlite':
+        scans = []
+        for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}'):
+            # "SCAN books" - полный просмотр; "SCAN books USING INDEX ..." - обход индекса
+            match = re.fullmatch(r'SCAN (?:TABLE )?(\w+)(?: AS \w+)?', row[-1])
+            if match and match.group(1) in tables:
+                scans.append(match.group(1))
+        return scans
+    rows = connection.exec_driver_sql(f'EXPLAIN {sql}').mappings()
+    return [row['table'] for row in rows if row['type'] == 'ALL' and row['table'] in tables]
+
+
+def check(connection):
+    """Печатает результат по каждому запросу и возвращает число проблемных"""
+    failed = 0
+    for name, statement in route_queries(connection):
+        scans = full_scans(connection, statement)
+        if scans:
+            failed += 1
+            print(f'FAIL {name}: полный просмотр {", ".join(scans)}')
+        else:
+            print(f'ok   {name}')
+    return failed
+
+
+if __name__ == '__main__':
+    with app.app_context(), db.engine.connect() as connection:
+        sys.exit(1 if check(connection) else 0)
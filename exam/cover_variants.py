@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Уменьшенные варианты обложек (карточка, страница книги, retina) в JPEG и WebP
+"""
+
+import os
+import shutil
+import tempfile
+
+from PIL import Image, ImageOps
+
+# Максимальные размеры (ширина, высота); пропорции обложки сохраняются
+VARIANT_SIZES = {
+    'card': (300, 400),
+    'card_2x': (600, 800),
+    'detail': (400, 600),
+    'detail_2x': (800, 1200),
+}
+
+VARIANT_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+VARIANTS_DIRNAME = 'variants'
+
+
+def variants_dir(upload_folder, key):
+    # Раскладываем по префиксу ключа, как и сами обложки
+    return os.path.join(upload_folder, VARIANTS_DIRNAME, key[:2], key[2:4], key)
+
+
+def variant_path(upload_folder, key, size, fmt):
+    return os.path.join(variants_dir(upload_folder, key), f'{size}.{fmt}')
+
+
+def _prepare(image, fmt):
+    image = ImageOps.exif_transpose(image)
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        # JPEG не поддерживает прозрачность: кладём изображение на белый фон
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    return image
+
+
+def generate_variant(source_path, upload_folder, key, size, fmt):
+    """Создаёт один вариант и возвращает путь к нему"""
+    pil_format, _ = VARIANT_FORMATS[fmt]
+    dest_path = variant_path(upload_folder, key, size, fmt)
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+    with Image.open(source_path) as image:
+        image = _prepare(image, fmt)
+        image.thumbnail(VARIANT_SIZES[size], Image.Resampling.LANCZOS)
+
+        # Пишем во временный файл и переименовываем, чтобы параллельные
+        # запросы никогда не увидели недописанный вариант
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                image.save(f, pil_format, quality=85, optimize=True)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    return dest_path
+
+
+def generate_variants(source_path, upload_folder, key):
+    """Создаёт все варианты обложки"""
+    for size in VARIANT_SIZES:
+        for fmt in VARIANT_FORMATS:
+            generate_variant(source_path, upload_folder, key, size, fmt)
+
+
+def remove_variants(upload_folder, key):
+    shutil.rmtree(variants_dir(upload_folder, key), ignore_errors=True)
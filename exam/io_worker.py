@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Фоновая очередь файловых операций с журналом на диске
+
+Каждое задание сначала дописывается в журнал процесса (journal-<pid>.jsonl),
+затем выполняется в пуле потоков с повторами. Журнал держится под flock:
+журналы, которые никто не держит, остались от упавших процессов, и их
+незавершённые задания выполняются заново вызовом replay_orphans(). Поэтому
+задания должны быть идемпотентными.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+JOBS = {}
+
+
+def job(name):
+    """Регистрирует обработчик задания; первым аргументом он получает очередь,
+    остальные аргументы задания должны сериализоваться в JSON"""
+    def decorator(f):
+        JOBS[name] = f
+        return f
+    return decorator
+
+
+class IOQueue:
+    def __init__(self, journal_dir, workers=2, max_attempts=3, retry_delay=0.5):
+        self.journal_dir = journal_dir
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.completed = 0
+        self.failed = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._journal = None
+        self._executor = None
+        self.pid = None
+
+    def start(self):
+        """Открывает журнал процесса; задания упавших процессов повторяет replay_orphans()"""
+        self.pid = os.getpid()
+        os.makedirs(self.journal_dir, exist_ok=True)
+        path = os.path.join(self.journal_dir, f'journal-{os.getpid()}.jsonl')
+        self._journal = open(path, 'a+', encoding='utf-8')
+        fcntl.flock(self._journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if self.workers:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='io-worker')
+        return self
+
+    def replay_orphans(self):
+        """Повторяет незавершённые задания из журналов, которые никто не держит.
+        Вызывается, когда очередь уже доступна заданиям: при workers=0 они
+        выполняются прямо здесь"""
+        own_path = self._journal.name
+        for name in sorted(os.listdir(self.journal_dir)):
+            path = os.path.join(self.journal_dir, name)
+            if path == own_path or not name.endswith('.jsonl'):
+                continue
+            with open(path, 'r+', encoding='utf-8') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # журнал живого процесса
+                jobs = unfinished_jobs(f)
+            for entry in jobs:
+                logger.info('Повтор задания %s из %s', entry['job'], name)
+                self.submit(entry['job'], **entry['args'])
+            # Задания переписаны в свой журнал: старый больше не нужен
+            os.remove(path)
+
+    def _write(self, record):
+        # Вызывается под self._lock
+        self._journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def submit(self, name, /, **args):
+        if name not in JOBS:
+            raise KeyError(f'Неизвестное задание {name}')
+        job_id = uuid.uuid4().hex
+        # Запись и регистрация - под одной блокировкой: иначе _finish другого
+        # задания между ними увидит пустой _pending и обрежет журнал с этой записью
+        with self._lock:
+            self._write({'id': job_id, 'job': name, 'args': args})
+            self._pending.add(job_id)
+        if self._executor is None:
+            self._run(job_id, name, args)
+        else:
+            self._executor.submit(self._run, job_id, name, args)
+        return job_id
+
+    def _run(self, job_id, name, args):
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                JOBS[name](self, **args)
+            except Exception:
+                if attempt == self.max_attempts:
+                    logger.exception('Задание %s не выполнено за %d попыток', name, attempt)
+                    self.failed += 1
+                    self._finish(job_id, failed=True)
+                    return
+                logger.warning('Задание %s: ошибка, попытка %d из %d', name, attempt, self.max_attempts, exc_info=True)
+                if self._executor is not None:
+                    time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            else:
+                self.completed += 1
+                self._finish(job_id)
+                return
+
+    def _finish(self, job_id, failed=False):
+        with self._lock:
+            self._write({'id': job_id, 'failed' if failed else 'done': True})
+            self._pending.discard(job_id)
+            if not self._pending:
+                # Всё выполнено: журнал можно начать заново
+                self._journal.truncate(0)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+
+def unfinished_jobs(journal):
+    """Задания журнала без отметки о завершении, в порядке добавления"""
+    journal.seek(0)
+    jobs = {}
+    for line in journal:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue  # строка, недописанная при падении
+        if 'job' in record:
+            jobs[record['id']] = record
+        else:
+            jobs.pop(record['id'], None)
+    return list(jobs.values())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Метрики запросов в текстовом формате Prometheus
+
+Значения хранятся в памяти процесса: при нескольких воркерах gunicorn
+каждый отдаёт свои, Prometheus различает их по instance/pid.
+"""
+
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class CallbackCounter:
+    """Счётчик, значения которого хранит другой объект; callback -> {метки: значение}"""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels, callback):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+
+    def samples(self):
+        for labels, value in sorted(self.callback().items()):
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (последняя - +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(labels) or ([0] * (len(self.buckets) + 1), 0)
+            counts[index] += 1
+            self._values[labels] = (counts, total + value)
+
+    def count(self, labels=()):
+        counts, _ = self._values.get(labels, ((), 0))
+        return sum(counts)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', _format_labels(self.labels, labels, [('le', _format_value(bound))]), cumulative
+            yield f'{self.name}_count', _format_labels(self.labels, labels), cumulative
+            yield f'{self.name}_sum', _format_labels(self.labels, labels), total
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    """Метрики HTTP-запросов приложения в разрезе endpoint"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or Registry()
+        self.requests = self.registry.register(Counter(
+            'flask_requests_total', 'Обработанные запросы', ('endpoint', 'method', 'status')))
+        self.latency = self.registry.register(Histogram(
+            'flask_request_duration_seconds', 'Время обработки запроса', ('endpoint', 'method')))
+        self.db_time = self.registry.register(Histogram(
+            'flask_request_db_seconds', 'Время SQL-запросов за запрос', ('endpoint',)))
+        self.statements = self.registry.register(Histogram(
+            'flask_request_sql_statements', 'Число SQL-запросов за запрос', ('endpoint',), STATEMENT_BUCKETS))
+        self.response_size = self.registry.register(Histogram(
+            'flask_response_size_bytes', 'Размер тела ответа', ('endpoint',), SIZE_BUCKETS))
+
+    def observe(self, endpoint, method, status, duration, db_time, statements, size=None):
+        self.requests.inc((endpoint, method, str(status)))
+        self.latency.observe(duration, (endpoint, method))
+        self.db_time.observe(db_time, (endpoint,))
+        self.statements.observe(statements, (endpoint,))
+        if size is not None:
+            self.response_size.observe(size, (endpoint,))
+
+    def render(self):
+        return self.registry.render()
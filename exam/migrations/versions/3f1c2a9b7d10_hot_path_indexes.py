@@ -0,0 +1,49 @@
+"""Индексы для списков книг, рецензий и подборок
+
+Revision ID: 3f1c2a9b7d10
+Revises: 
+Create Date: 2026-10-18 12:00:00
+
+Таблицы могли быть созданы через db.create_all() (init_db.py) уже с этими
+индексами, а в MySQL внешние ключи сами заводят индекс по своему столбцу,
+поэтому создаём только те индексы, которых нет ни под каким именем.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('ix_reviews_book_created', 'reviews', ['book_id', 'created_at']),
+    ('ix_reviews_user_id', 'reviews', ['user_id']),
+    ('ix_collections_user_created', 'collections', ['user_id', 'created_at']),
+    ('ix_books_year_id', 'books', ['year', 'id']),
+    ('ix_book_genres_genre_id', 'book_genres', ['genre_id']),
+)
+
+
+def _has_index(inspector, table, columns):
+    for index in inspector.get_indexes(table):
+        if index['column_names'][:len(columns)] == columns:
+            return True
+    return False
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if not _has_index(inspector, table, columns):
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    for name, table, columns in INDEXES:
+        if name in {index['name'] for index in inspector.get_indexes(table)}:
+            op.drop_index(name, table_name=table)
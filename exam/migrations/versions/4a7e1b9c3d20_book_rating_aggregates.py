@@ -0,0 +1,47 @@
+"""Агрегаты рейтинга у книг
+
+Revision ID: 4a7e1b9c3d20
+Revises: c5d9e3f7a2b4
+Create Date: 2026-10-19 10:00:00
+
+Столбцы могли появиться через db.create_all(), поэтому добавляются только
+отсутствующие; значения в любом случае пересчитываются по reviews.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a7e1b9c3d20'
+down_revision = 'c5d9e3f7a2b4'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = (
+    ('rating_sum', lambda: sa.Column('rating_sum', sa.Integer(), nullable=False, server_default='0')),
+    ('rating_count', lambda: sa.Column('rating_count', sa.Integer(), nullable=False, server_default='0')),
+    ('rating_avg', lambda: sa.Column('rating_avg', sa.Float(), nullable=True)),
+)
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('books')}
+    for name, column in COLUMNS:
+        if name not in existing:
+            op.add_column('books', column())
+
+    books = sa.table('books', sa.column('id'), *(sa.column(name) for name, _ in COLUMNS))
+    reviews = sa.table('reviews', sa.column('book_id'), sa.column('rating'))
+    of_book = reviews.c.book_id == books.c.id
+    op.execute(books.update().values(
+        rating_count=sa.select(sa.func.count()).where(of_book).scalar_subquery(),
+        rating_sum=sa.select(sa.func.coalesce(sa.func.sum(reviews.c.rating), 0)).where(of_book).scalar_subquery(),
+        rating_avg=sa.select(sa.func.avg(reviews.c.rating)).where(of_book).scalar_subquery(),
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('books') as batch_op:
+        for name, _ in COLUMNS:
+            batch_op.drop_column(name)
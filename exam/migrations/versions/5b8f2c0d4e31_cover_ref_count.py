@@ -0,0 +1,36 @@
+"""Счётчик ссылок на обложки
+
+Revision ID: 5b8f2c0d4e31
+Revises: 4a7e1b9c3d20
+Create Date: 2026-10-19 10:10:00
+
+Столбец мог появиться через db.create_all(), поэтому добавляется только при
+отсутствии; значения в любом случае пересчитываются по books - с нулевым
+счётчиком первая же замена обложки удалила бы общий файл.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8f2c0d4e31'
+down_revision = '4a7e1b9c3d20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('covers')}
+    if 'ref_count' not in existing:
+        op.add_column('covers', sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'))
+
+    covers = sa.table('covers', sa.column('id'), sa.column('ref_count'))
+    books = sa.table('books', sa.column('cover_id'))
+    op.execute(covers.update().values(
+        ref_count=sa.select(sa.func.count()).where(books.c.cover_id == covers.c.id).scalar_subquery()
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('covers') as batch_op:
+        batch_op.drop_column('ref_count')
@@ -0,0 +1,33 @@
+"""Готовый HTML описаний книг
+
+Revision ID: 6c9a3d1e5f42
+Revises: 5b8f2c0d4e31
+Create Date: 2026-10-19 10:20:00
+
+Столбцы могли появиться через db.create_all(), поэтому добавляются только
+отсутствующие. Книги получают версию рендерера 0 и перерисовываются при
+первом просмотре или командой flask books render-descriptions.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c9a3d1e5f42'
+down_revision = '5b8f2c0d4e31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('books')}
+    if 'description_html' not in existing:
+        op.add_column('books', sa.Column('description_html', sa.Text(), nullable=True))
+    if 'description_html_version' not in existing:
+        op.add_column('books', sa.Column('description_html_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('books') as batch_op:
+        batch_op.drop_column('description_html_version')
+        batch_op.drop_column('description_html')
@@ -0,0 +1,42 @@
+"""Полнотекстовый индекс книг
+
+Revision ID: 7d0b4e2f6a53
+Revises: 6c9a3d1e5f42
+Create Date: 2026-10-19 10:30:00
+
+В SQLite - таблица FTS5 books_fts, заполняемая по books, в MySQL - индекс
+FULLTEXT. И то и другое могло появиться через db.create_all(), поэтому
+создаётся только отсутствующее.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d0b4e2f6a53'
+down_revision = '6c9a3d1e5f42'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = 'title, author, publisher, description'
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5({COLUMNS}, tokenize='unicode61')")
+        op.execute('DELETE FROM books_fts')
+        op.execute(f'INSERT INTO books_fts (rowid, {COLUMNS}) SELECT id, {COLUMNS} FROM books')
+    elif bind.dialect.name == 'mysql':
+        indexes = {index['name'] for index in sa.inspect(bind).get_indexes('books')}
+        if 'ft_books_search' not in indexes:
+            op.execute(f'CREATE FULLTEXT INDEX ft_books_search ON books ({COLUMNS})')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS books_fts')
+    elif bind.dialect.name == 'mysql':
+        op.execute('DROP INDEX ft_books_search ON books')
@@ -0,0 +1,43 @@
+"""Счётчики оценок 1-5 у книг
+
+Revision ID: 8b4e6d2c1a57
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 15:00:00
+
+Столбцы могли появиться через db.create_all(), поэтому добавляются только
+отсутствующие; значения в любом случае пересчитываются по reviews.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d2c1a57'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+STAR_COLUMNS = [f'rating_{stars}' for stars in range(1, 6)]
+
+
+def upgrade():
+    existing = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('books')}
+    for name in STAR_COLUMNS:
+        if name not in existing:
+            op.add_column('books', sa.Column(name, sa.Integer(), nullable=False, server_default='0'))
+
+    books = sa.table('books', sa.column('id'), *(sa.column(name) for name in STAR_COLUMNS))
+    reviews = sa.table('reviews', sa.column('book_id'), sa.column('rating'))
+    op.execute(books.update().values({
+        name: sa.select(sa.func.count())
+        .where(reviews.c.book_id == books.c.id, reviews.c.rating == stars)
+        .scalar_subquery()
+        for stars, name in enumerate(STAR_COLUMNS, 1)
+    }))
+
+
+def downgrade():
+    with op.batch_alter_table('books') as batch_op:
+        for name in STAR_COLUMNS:
+            batch_op.drop_column(name)
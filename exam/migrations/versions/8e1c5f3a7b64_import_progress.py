@@ -0,0 +1,32 @@
+"""Смещения импорта каталога
+
+Revision ID: 8e1c5f3a7b64
+Revises: 7d0b4e2f6a53
+Create Date: 2026-10-19 10:40:00
+
+Таблица могла появиться через db.create_all(), поэтому создаётся только
+при отсутствии.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e1c5f3a7b64'
+down_revision = '7d0b4e2f6a53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'import_progress' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'import_progress',
+            sa.Column('source', sa.String(255), primary_key=True),
+            sa.Column('offset', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('import_progress')
@@ -0,0 +1,46 @@
+"""Похожие книги и журнал их пересчёта
+
+Revision ID: c5d9e3f7a2b4
+Revises: 8b4e6d2c1a57
+Create Date: 2026-10-18 18:00:00
+
+Таблицы могли появиться через db.create_all(), поэтому создаются только
+отсутствующие; заполняет их команда flask books recommend.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d9e3f7a2b4'
+down_revision = '8b4e6d2c1a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'book_similar' not in existing:
+        op.create_table(
+            'book_similar',
+            sa.Column('book_id', sa.Integer(), sa.ForeignKey('books.id', ondelete='CASCADE'), primary_key=True),
+            sa.Column('rank', sa.Integer(), primary_key=True, autoincrement=False),
+            sa.Column('similar_book_id', sa.Integer(), sa.ForeignKey('books.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('score', sa.Float(), nullable=False),
+        )
+        op.create_index('ix_book_similar_similar_book_id', 'book_similar', ['similar_book_id'])
+    if 'recommendation_runs' not in existing:
+        op.create_table(
+            'recommendation_runs',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('started_at', sa.DateTime(), nullable=False),
+            sa.Column('finished_at', sa.DateTime(), nullable=False),
+            sa.Column('full', sa.Boolean(), nullable=False),
+            sa.Column('books_updated', sa.Integer(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table('recommendation_runs')
+    op.drop_index('ix_book_similar_similar_book_id', table_name='book_similar')
+    op.drop_table('book_similar')
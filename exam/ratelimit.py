@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ограничение частоты попыток входа: корзины токенов по IP и по логину
+
+Проверка выполняется до check_password_hash, поэтому отказ стоит одного
+обращения к словарю или к небольшой таблице SQLite.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def parse_rate(value):
+    """'20/60' -> (20, 60): не больше 20 попыток подряд, восстановление за 60 секунд"""
+    capacity, period = value.split('/')
+    return int(capacity), float(period)
+
+
+class MemoryBackend:
+    """Корзины в памяти процесса в порядке последнего обращения: устаревшие и
+    лишние сверх max_keys вытесняются с начала за O(1) на вызов"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, period, now):
+        """(разрешено, через сколько секунд появится токен)"""
+        rate = capacity / period
+        with self._lock:
+            tokens, updated, _ = self._buckets.pop(key, (capacity, now, period))
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now, period)
+            self._evict(now)
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+    def _evict(self, now):
+        # Корзина, не тронутая дольше своего периода, снова полна: её можно забыть
+        while self._buckets:
+            _, updated, period = next(iter(self._buckets.values()))
+            if now - updated <= period and len(self._buckets) <= self.max_keys:
+                break
+            self._buckets.popitem(last=False)
+
+
+class SQLiteBackend:
+    """Корзины в файле SQLite, общем для всех воркеров на машине"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._calls = 0
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def consume(self, key, capacity, period, now):
+        rate = capacity / period
+        connection = self._connect()
+        # BEGIN IMMEDIATE сразу берёт блокировку записи: чтение и обновление корзины атомарны
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            connection.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                               (key, tokens, now))
+            self._calls += 1
+            if self._calls % 1000 == 0:
+                connection.execute('DELETE FROM buckets WHERE updated < ?', (now - period,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, 0.0 if allowed else (1 - tokens) / rate
+
+
+class LoginLimiter:
+    def __init__(self, backend, ip_rate, user_rate):
+        self.backend = backend
+        self.ip_rate = ip_rate
+        self.user_rate = user_rate
+        self.counters = {'allowed': 0, 'limited_ip': 0, 'limited_user': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, result):
+        with self._lock:
+            self.counters[result] += 1
+
+    def check(self, ip, username):
+        """(результат, retry_after): результат - 'allowed', 'limited_ip' или 'limited_user'"""
+        now = time.time()
+        # Сначала IP: перебор логинов с одного адреса не должен блокировать сами логины
+        allowed, retry_after = self.backend.consume(f'ip:{ip}', *self.ip_rate, now)
+        if not allowed:
+            self._count('limited_ip')
+            return 'limited_ip', retry_after
+        allowed, retry_after = self.backend.consume(f'user:{username.strip().lower()[:100]}', *self.user_rate, now)
+        if not allowed:
+            self._count('limited_user')
+            return 'limited_user', retry_after
+        self._count('allowed')
+        return 'allowed', 0.0
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Похожие книги по оценкам читателей: косинусная близость столбцов
+разреженной матрицы пользователь x книга
+
+Считается офлайн командой flask books recommend; страница книги только
+читает готовый список из таблицы book_similar.
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+class RatingMatrix:
+    """Оценки в виде матрицы пользователь x книга с нормированными столбцами;
+    нужна хотя бы одна оценка"""
+
+    def __init__(self, user_ids, book_ids, ratings):
+        self.book_ids, book_columns = np.unique(np.asarray(book_ids, dtype=np.int64), return_inverse=True)
+        _, user_rows = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+        matrix = sparse.csc_matrix(
+            (np.asarray(ratings, dtype=np.float64), (user_rows, book_columns)),
+            shape=(user_rows.max() + 1, len(self.book_ids)),
+        )
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0))).ravel()
+        norms[norms == 0] = 1.0
+        # После деления скалярное произведение столбцов и есть косинус
+        self.normalized = matrix @ sparse.diags(1.0 / norms)
+        self._transposed = self.normalized.T.tocsr()
+
+    def columns(self, book_ids):
+        """Номера столбцов для id книг; книг без оценок в матрице нет"""
+        book_ids = np.asarray(book_ids, dtype=np.int64)
+        positions = np.searchsorted(self.book_ids, book_ids)
+        inside = positions < len(self.book_ids)
+        positions, book_ids = positions[inside], book_ids[inside]
+        return positions[self.book_ids[positions] == book_ids]
+
+    def similarities(self, columns):
+        """Разреженная матрица косинусов: строки - columns, столбцы - все книги"""
+        return (self._transposed[columns] @ self.normalized).tocsr()
+
+    def neighbours(self, columns, k, batch_size=1000):
+        """Для каждой книги из columns: (book_id, [(похожая book_id, косинус), ...]) по убыванию близости"""
+        for start in range(0, len(columns), batch_size):
+            batch = columns[start:start + batch_size]
+            scores = self.similarities(batch)
+            for row, column in enumerate(batch):
+                begin, end = scores.indptr[row], scores.indptr[row + 1]
+                candidates = scores.indices[begin:end]
+                values = scores.data[begin:end]
+                keep = (candidates != column) & (values > 0)
+                candidates, values = candidates[keep], values[keep]
+                if len(values) > k:
+                    top = np.argpartition(-values, k - 1)[:k]
+                    candidates, values = candidates[top], values[top]
+                # При равных оценках - меньший id первым, чтобы результат был стабильным
+                order = np.lexsort((self.book_ids[candidates], -values))
+                yield int(self.book_ids[column]), [
+                    (int(self.book_ids[candidates[i]]), float(values[i])) for i in order
+                ]
+
+
+def affected_books(matrix, changed_ids, current, k):
+    """Книги, чей список соседей мог измениться из-за новых оценок changed_ids
+
+    current - {book_id: [(похожая book_id, косинус), ...]} из прошлого расчёта.
+    Список книги b пересчитывается, если в нём есть изменившаяся книга или
+    её новая близость к изменившейся книге выше худшего из сохранённых соседей.
+    """
+    changed = set(changed_ids)
+    affected = set(changed)
+    for book_id, neighbours in current.items():
+        if any(neighbour_id in changed for neighbour_id, _ in neighbours):
+            affected.add(book_id)
+
+    columns = matrix.columns(sorted(changed))
+    if len(columns):
+        scores = matrix.similarities(columns).tocsc()
+        best = np.asarray(scores.max(axis=0).todense()).ravel()
+        for column in np.flatnonzero(best > 0):
+            book_id = int(matrix.book_ids[column])
+            if book_id in affected:
+                continue
+            neighbours = current.get(book_id, [])
+            if len(neighbours) < k or best[column] > min(score for _, score in neighbours):
+                affected.add(book_id)
+    return affected
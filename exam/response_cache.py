@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш готовых страниц для анонимных посетителей
+
+Ключ записи - URL плюс текущие версии данных, от которых зависит страница
+(например, версия книги). Изменение данных увеличивает версию, и старые
+записи просто перестают находиться, а затем вытесняются по лимиту размера.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class MemoryLRUBackend:
+    """Записи в памяти процесса; версии видны только этому процессу"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_version(self, name):
+        return self._versions.get(name, '0')
+
+    def bump_version(self, name):
+        self._versions[name] = uuid.uuid4().hex
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+            self._size = 0
+
+
+class FileBackend:
+    """Записи и версии в каталоге на диске: общие для всех воркеров одной машины"""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries_dir = os.path.join(directory, 'entries')
+        self._versions_dir = os.path.join(directory, 'versions')
+        os.makedirs(self._entries_dir, exist_ok=True)
+        os.makedirs(self._versions_dir, exist_ok=True)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self._entries_dir, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            # mtime служит отметкой последнего использования для вытеснения
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        self._write(self._path(key), value)
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_size()
+            else:
+                self._size += len(value)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _scan(self):
+        with os.scandir(self._entries_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _disk_size(self):
+        return sum(size for _, size, _ in self._scan())
+
+    def _evict(self):
+        # Размер пересчитываем по диску: записи добавляют и другие процессы.
+        # Освобождаем до 90% лимита, чтобы не сканировать каталог на каждой записи
+        files = sorted(self._scan(), key=lambda item: item[2])
+        size = sum(item[1] for item in files)
+        target = self.max_bytes * 0.9
+        for path, file_size, _ in files:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        self._size = size
+
+    def get_version(self, name):
+        try:
+            with open(os.path.join(self._versions_dir, name), encoding='ascii') as f:
+                return f.read()
+        except FileNotFoundError:
+            return '0'
+
+    def bump_version(self, name):
+        # Случайная метка вместо счётчика: одновременные увеличения из разных
+        # процессов не требуют блокировки
+        self._write(os.path.join(self._versions_dir, name), uuid.uuid4().hex.encode('ascii'))
+
+    def clear(self):
+        for directory in (self._entries_dir, self._versions_dir):
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+        self._size = 0
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, url, versions):
+        return url + '|' + ','.join(f'{name}={self.backend.get_version(name)}' for name in versions)
+
+    def get(self, key):
+        """(mimetype, тело) или None"""
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        header, body = value.split(b'\n', 1)
+        meta = json.loads(header)
+        if meta['expires'] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return meta['mimetype'], body
+
+    def set(self, key, mimetype, body):
+        header = json.dumps({'mimetype': mimetype, 'expires': time.time() + self.ttl}).encode('utf-8')
+        self.backend.set(key, header + b'\n' + body)
+
+    def bump(self, *names):
+        for name in names:
+            self.backend.bump_version(name)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Полнотекстовый поиск по книгам: FULLTEXT-индекс в MySQL, FTS5 в SQLite
+"""
+
+import re
+
+from sqlalchemy import DDL, event, func, literal_column, select, text
+from sqlalchemy.dialects.mysql import match
+
+SEARCH_COLUMNS = ('title', 'author', 'publisher', 'description')
+FULLTEXT_INDEX = 'ft_books_search'
+FTS_TABLE = 'books_fts'
+
+
+def install(books):
+    """Создаёт поисковый индекс вместе с таблицей books"""
+    columns = ', '.join(SEARCH_COLUMNS)
+    event.listen(books, 'after_create', DDL(
+        f'CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON {books.name} ({columns})'
+    ).execute_if(dialect='mysql'))
+    event.listen(books, 'after_create', DDL(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, tokenize='unicode61')"
+    ).execute_if(dialect='sqlite'))
+    event.listen(books, 'after_drop', DDL(
+        f'DROP TABLE IF EXISTS {FTS_TABLE}'
+    ).execute_if(dialect='sqlite'))
+
+
+def _uses_fts5(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def index_book(connection, book):
+    """Обновляет запись книги в FTS5; FULLTEXT в MySQL обновляется сам"""
+    if not _uses_fts5(connection):
+        return
+    unindex_book(connection, book.id)
+    index_rows(connection, [{'id': book.id, **{c: getattr(book, c) for c in SEARCH_COLUMNS}}])
+
+
+def index_rows(connection, rows):
+    """Добавляет в FTS5 новые книги, вставленные пачкой; rows - словари с id и SEARCH_COLUMNS"""
+    if not _uses_fts5(connection) or not rows:
+        return
+    connection.execute(
+        text(f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(SEARCH_COLUMNS)}) '
+             f'VALUES (:id, {", ".join(":" + c for c in SEARCH_COLUMNS)})'),
+        [{'id': row['id'], **{c: row[c] for c in SEARCH_COLUMNS}} for row in rows],
+    )
+
+
+def unindex_book(connection, book_id):
+    if _uses_fts5(connection):
+        connection.execute(text(f'DELETE FROM {FTS_TABLE} WHERE rowid = :id'), {'id': book_id})
+
+
+def rebuild(connection, books):
+    """Перестраивает индекс целиком (для данных, внесённых в обход ORM)"""
+    if _uses_fts5(connection):
+        connection.execute(text(f'DELETE FROM {FTS_TABLE}'))
+        columns = ', '.join(SEARCH_COLUMNS)
+        connection.execute(text(
+            f'INSERT INTO {FTS_TABLE} (rowid, {columns}) SELECT id, {columns} FROM {books.name}'
+        ))
+    elif connection.dialect.name == 'mysql':
+        exists = connection.execute(text(
+            'SELECT 1 FROM information_schema.STATISTICS '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND INDEX_NAME = :index LIMIT 1'
+        ), {'table': books.name, 'index': FULLTEXT_INDEX}).first()
+        if not exists:
+            connection.execute(text(
+                f'CREATE FULLTEXT INDEX {FULLTEXT_INDEX} ON {books.name} ({", ".join(SEARCH_COLUMNS)})'
+            ))
+
+
+def _fts5_query(query):
+    # Каждое слово в кавычках, чтобы пользовательский ввод не разбирался как синтаксис FTS5
+    words = re.findall(r'\w+', query)
+    return ' OR '.join(f'"{word}"' for word in words)
+
+
+def match_query(connection, books, query):
+    """SELECT (book_id, score) по релевантности или None, если искать нечего"""
+    if not re.search(r'\w', query):
+        return None
+
+    if _uses_fts5(connection):
+        return (
+            select(literal_column('rowid').label('book_id'),
+                   (-func.bm25(literal_column(FTS_TABLE))).label('score'))
+            .select_from(text(FTS_TABLE))
+            .where(text(f'{FTS_TABLE} MATCH :fts_query').bindparams(fts_query=_fts5_query(query)))
+        )
+
+    score = match(*(books.c[c] for c in SEARCH_COLUMNS), against=query)
+    return select(books.c.id.label('book_id'), score.label('score')).where(score > 0)
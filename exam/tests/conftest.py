@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+import pytest
+
+_db_fd, _db_path = tempfile.mkstemp(suffix='.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{_db_path}'
+
+from app import app as application, db, genre_registry, Role, User, Cover, Book
+
+
+@pytest.fixture
+def app(tmp_path, tmp_path_factory):
+    application.config['TESTING'] = True
+    application.config['QUERY_COUNT_HEADER'] = True
+    application.config['UPLOAD_FOLDER'] = str(tmp_path)
+    application.config['RESPONSE_CACHE'] = 'off'
+    application.extensions.pop('login_limiter', None)
+    # Файловые задания выполняются сразу после коммита, без потоков
+    application.config['IO_WORKERS'] = 0
+    application.config['IO_JOURNAL_DIR'] = str(tmp_path_factory.mktemp('io-journal'))
+
+    with application.app_context():
+        db.create_all()
+        # База пересоздаётся для каждого теста, кеш процесса - нет
+        genre_registry.invalidate()
+        yield application
+        db.session.remove()
+        db.drop_all()
+        # Задания очереди открывают свои соединения; в пуле SQLite они помнят старую схему
+        db.engine.dispose()
+    io_queue = application.extensions.pop('io_queue', None)
+    if io_queue is not None:
+        io_queue.shutdown()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def runner(app):
+    return app.test_cli_runner()
+
+
+@pytest.fixture
+def roles(app):
+    admin_role = Role(name='администратор', description='Полный доступ')
+    moderator_role = Role(name='модератор', description='Редактирование книг')
+    user_role = Role(name='пользователь', description='Рецензии и подборки')
+    db.session.add_all([admin_role, moderator_role, user_role])
+    db.session.commit()
+    return {'admin': admin_role, 'moderator': moderator_role, 'user': user_role}
+
+
+def make_user(username, role):
+    user = User(username=username, first_name='Тест', last_name=username, role_id=role.id)
+    user.set_password(f'{username}123')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def admin_user(roles):
+    return make_user('admin', roles['admin'])
+
+
+@pytest.fixture
+def regular_user(roles):
+    return make_user('user', roles['user'])
+
+
+def make_book(title='Книга', year=2020, genres=()):
+    cover = Cover(filename=f'{title}.jpg', mime_type='image/jpeg', md5_hash=os.urandom(16).hex())
+    db.session.add(cover)
+    db.session.flush()
+    book = Book(title=title, description='Описание', year=year, publisher='Издательство',
+                author='Автор', pages=100, cover_id=cover.id)
+    book.genres.extend(genres)
+    db.session.add(book)
+    db.session.commit()
+    return book
+
+
+@pytest.fixture
+def book(app):
+    return make_book()
+
+
+def login_user(client, username, password):
+    return client.post('/login', data={
+        'username': username,
+        'password': password
+    }, follow_redirects=True)
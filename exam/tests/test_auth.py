@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from app import db, User
+from conftest import login_user
+
+
+@pytest.fixture
+def role_cache(app):
+    app.config['SESSION_ROLE_CACHE'] = True
+    yield app
+    app.config['SESSION_ROLE_CACHE'] = False
+    app.config['ROLE_VERSION'] = '1'
+
+
+def test_role_is_read_from_db_by_default(client, admin_user, roles):
+    login_user(client, 'admin', 'admin123')
+    response = client.get('/book/add')
+    assert response.status_code == 200
+    # Пользователь с ролью одним JOIN-запросом и список жанров
+    assert response.headers['X-Query-Count'] == '2'
+
+    db.session.get(User, admin_user.id).role_id = roles['user'].id
+    db.session.commit()
+    assert client.get('/book/add').status_code == 302
+
+
+def test_session_is_not_rewritten_without_role_cache(client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    response = client.get('/book/add')
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_admin_route_uses_session_role(role_cache, client, admin_user):
+    login_user(client, 'admin', 'admin123')
+
+    response = client.get('/book/add')
+    assert response.status_code == 200
+    # Только список жанров: пользователь и роль взяты из сессии
+    assert response.headers['X-Query-Count'] == '1'
+
+
+def test_role_version_bump_reloads_role_once(role_cache, client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    role_cache.config['ROLE_VERSION'] = '2'
+    first = client.get('/book/add')
+    second = client.get('/book/add')
+    # Пользователь с ролью одним JOIN-запросом, затем снова из сессии;
+    # жанры формы читаются только при первом показе
+    assert first.headers['X-Query-Count'] == '2'
+    assert second.headers['X-Query-Count'] == '0'
+
+
+def test_cached_role_expires_after_ttl(role_cache, client, admin_user, roles, monkeypatch):
+    login_user(client, 'admin', 'admin123')
+    db.session.get(User, admin_user.id).role_id = roles['user'].id
+    db.session.commit()
+    assert client.get('/book/add').status_code == 200
+
+    expired = time.time() + role_cache.config['SESSION_ROLE_TTL'] + 1
+    monkeypatch.setattr(time, 'time', lambda: expired)
+    assert client.get('/book/add').status_code == 302
+
+
+def test_regular_user_cannot_add_books(client, regular_user):
+    login_user(client, 'user', 'user123')
+    assert client.get('/book/add').status_code == 302
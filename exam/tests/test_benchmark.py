@@ -0,0 +1,41 @@
+import pytest
+
+from app import db, Book, Collection, Cover, Review
+from benchmark import compare, percentile, run_benchmark, seed_library
+
+PARAMS = {'books': 30, 'reviews': 100, 'collections': 25, 'users': 10, 'books_per_collection': 3, 'seed': 1}
+
+
+def test_seed_library_is_consistent(app):
+    seed_library(PARAMS, app.config['UPLOAD_FOLDER'], log=lambda message: None)
+
+    assert Book.query.count() == 30
+    assert Review.query.count() == 100
+    assert Collection.query.count() == 25
+    book = db.session.get(Book, 1)
+    assert book.rating_count == Review.query.filter_by(book_id=1).count()
+    assert sum(book.rating_distribution.values()) == book.rating_count
+    assert sum(cover.ref_count for cover in Cover.query) == 30
+
+
+@pytest.mark.parametrize('mode', ['client', 'server'])
+def test_run_benchmark_reports_every_endpoint(app, mode):
+    seed_library(PARAMS, app.config['UPLOAD_FOLDER'], log=lambda message: None)
+    db.session.remove()
+
+    report = run_benchmark(app, PARAMS, mode=mode, concurrency=2, requests=6, warmup=1, log=lambda message: None)
+    # Соединения из потоков стенда помнят схему этой базы, а следующий тест её пересоздаст
+    db.engine.dispose()
+
+    assert set(report['endpoints']) == {'index', 'book_detail', 'serve_cover', 'my_collections', 'api_user_collections'}
+    for name, result in report['endpoints'].items():
+        assert result['requests'] == 6, name
+        assert result['errors'] == 0, name
+        assert result['latency_ms']['p50'] <= result['latency_ms']['p99']
+    assert report['endpoints']['book_detail']['queries']['mean'] > 0
+    assert compare(report, report)[0].startswith('index: p50')
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert (percentile(values, 50), percentile(values, 95), percentile(values, 99)) == (50, 95, 99)
@@ -0,0 +1,107 @@
+from app import db, Collection
+from conftest import login_user, make_book, make_user
+
+
+def _collection(user, books=(), name='Избранное'):
+    collection = Collection(name=name, user_id=user.id)
+    collection.books.extend(books)
+    db.session.add(collection)
+    db.session.commit()
+    return collection
+
+
+def test_api_user_collections_counts_without_loading_books(client, regular_user):
+    small = _collection(regular_user, [make_book(title=f'А{i}') for i in range(2)], name='Малая')
+    login_user(client, 'user', 'user123')
+    first = client.get('/api/user_collections')
+
+    _collection(regular_user, [make_book(title=f'Б{i}') for i in range(15)], name='Большая')
+    second = client.get('/api/user_collections')
+
+    assert first.json == [{'id': small.id, 'name': 'Малая', 'book_count': 2}]
+    assert [c['book_count'] for c in second.json] == [2, 15]
+    # Пользователь с ролью и список подборок с числом книг
+    assert first.headers['X-Query-Count'] == second.headers['X-Query-Count'] == '2'
+
+
+def test_api_user_collections_etag(client, regular_user):
+    _collection(regular_user, [make_book()])
+    login_user(client, 'user', 'user123')
+
+    first = client.get('/api/user_collections')
+    etag = first.headers['ETag']
+    assert client.get('/api/user_collections', headers={'If-None-Match': etag}).status_code == 304
+
+    _collection(regular_user, name='Новая')
+    changed = client.get('/api/user_collections', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_collections_page_shows_counts(client, regular_user):
+    _collection(regular_user, [make_book(title=f'В{i}') for i in range(3)])
+    login_user(client, 'user', 'user123')
+
+    response = client.get('/collections')
+    assert response.status_code == 200
+    assert '3 книг(и)' in response.text
+
+
+def test_collection_page_lists_books(client, regular_user):
+    collection = _collection(regular_user, [make_book(title='Первая'), make_book(title='Вторая')])
+    login_user(client, 'user', 'user123')
+
+    page = client.get(f'/collections/{collection.id}').get_data(as_text=True)
+    assert 'Книг: 2' in page
+    assert 'Первая' in page and 'Вторая' in page
+
+
+def test_add_and_remove_single_book(client, regular_user):
+    book = make_book()
+    collection = _collection(regular_user)
+    login_user(client, 'user', 'user123')
+
+    client.post(f'/book/{book.id}/add_to_collection', data={'collection_id': collection.id})
+    response = client.post(f'/book/{book.id}/add_to_collection', data={'collection_id': collection.id},
+                           follow_redirects=True)
+    assert 'Книга уже находится в этой подборке' in response.text
+    assert [b.id for b in collection.books] == [book.id]
+
+    client.post(f'/collections/{collection.id}/remove_book/{book.id}')
+    db.session.expire_all()
+    assert collection.books == []
+
+
+def test_bulk_update_collection_books(client, regular_user):
+    books = [make_book(title=f'Г{i}') for i in range(5)]
+    collection = _collection(regular_user, books[:2])
+    login_user(client, 'user', 'user123')
+
+    response = client.post(f'/api/collections/{collection.id}/books', json={
+        'add': [b.id for b in books[1:]] + [9999],
+        'remove': [books[0].id],
+    })
+    assert response.json == {'added': 3, 'removed': 1, 'missing': [9999]}
+    db.session.expire_all()
+    assert sorted(b.id for b in collection.books) == [b.id for b in books[1:]]
+
+
+def test_bulk_update_rejects_foreign_collection(client, regular_user, roles):
+    other = make_user('other', roles['user'])
+    collection = _collection(other)
+    login_user(client, 'user', 'user123')
+
+    response = client.post(f'/api/collections/{collection.id}/books', json={'add': [1]})
+    assert response.status_code == 403
+
+
+def test_bulk_update_rejects_malformed_payload(client, regular_user):
+    book = make_book()
+    collection = _collection(regular_user)
+    login_user(client, 'user', 'user123')
+
+    for payload in ([book.id], {'add': str(book.id)}, {'add': [str(book.id)]}, {'remove': [True]}, {'add': None}):
+        response = client.post(f'/api/collections/{collection.id}/books', json=payload)
+        assert response.status_code == 400, payload
+    db.session.expire_all()
+    assert collection.books == []
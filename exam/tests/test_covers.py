@@ -0,0 +1,218 @@
+import hashlib
+import io
+import os
+
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+from app import db, Book, Cover, stream_upload
+from cover_variants import variant_path
+from conftest import login_user
+
+
+def make_image(size=(1200, 1600), color=(200, 30, 30), fmt='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, fmt)
+    buffer.seek(0)
+    return buffer
+
+
+def upload_book(client, image, title='Книга с обложкой'):
+    return client.post('/book/add', data={
+        'title': title,
+        'description': 'Описание',
+        'year': '2020',
+        'author': 'Автор',
+        'publisher': 'Издательство',
+        'pages': '100',
+        'cover': (image, 'cover.png', 'image/png'),
+    }, content_type='multipart/form-data')
+
+
+def test_upload_generates_variants(app, client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    upload_book(client, make_image())
+
+    cover = Cover.query.one()
+    for size in ('card', 'card_2x', 'detail', 'detail_2x'):
+        for fmt in ('jpeg', 'webp'):
+            assert os.path.exists(variant_path(app.config['UPLOAD_FOLDER'], cover.md5_hash, size, fmt))
+
+
+def test_serve_cover_negotiates_format(client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    upload_book(client, make_image())
+    cover = Cover.query.one()
+
+    webp = client.get(f'/cover/{cover.id}?size=card', headers={'Accept': 'image/webp,image/*'})
+    assert webp.mimetype == 'image/webp'
+    assert 'Accept' in webp.headers['Vary']
+    assert Image.open(io.BytesIO(webp.data)).size == (300, 400)
+
+    jpeg = client.get(f'/cover/{cover.id}?size=card', headers={'Accept': 'image/*'})
+    assert jpeg.mimetype == 'image/jpeg'
+
+    original = client.get(f'/cover/{cover.id}')
+    assert original.mimetype == 'image/png'
+
+
+def test_legacy_cover_variant_generated_lazily(app, client, book):
+    cover = db.session.get(Cover, book.cover_id)
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], cover.filename), 'wb') as f:
+        f.write(make_image(fmt='JPEG').getvalue())
+
+    response = client.get(f'/cover/{cover.id}?size=detail')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert Image.open(io.BytesIO(response.data)).size == (400, 533)
+
+
+def test_duplicate_upload_reuses_cover_and_discards_temp(app, client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    image = make_image().getvalue()
+    upload_book(client, io.BytesIO(image), title='Первая')
+    upload_book(client, io.BytesIO(image), title='Вторая')
+
+    assert Book.query.count() == 2
+    assert Cover.query.count() == 1
+    leftovers = [name for name in os.listdir(app.config['UPLOAD_FOLDER']) if name.startswith('.upload-')]
+    assert leftovers == []
+
+
+def test_stream_upload_hashes_in_chunks(app, monkeypatch):
+    monkeypatch.setattr('app.UPLOAD_CHUNK_SIZE', 1024)
+    data = os.urandom(10 * 1024 + 17)
+    with app.test_request_context():
+        tmp_path, digest = stream_upload(FileStorage(io.BytesIO(data), 'cover.png'))
+
+    assert digest == hashlib.md5(data).hexdigest()
+    assert os.path.dirname(tmp_path) == app.config['UPLOAD_FOLDER']
+    with open(tmp_path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_cover_stored_by_content_hash(app, client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    upload_book(client, make_image())
+
+    cover = Cover.query.one()
+    h = cover.md5_hash
+    assert cover.filename == f'{h[:2]}/{h[2:4]}/{h}.png'
+    assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], cover.filename))
+
+
+def test_cover_file_removed_with_last_reference(app, client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    image = make_image().getvalue()
+    upload_book(client, io.BytesIO(image), title='Первая')
+    upload_book(client, io.BytesIO(image), title='Вторая')
+    cover = Cover.query.one()
+    cover_id = cover.id
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], cover.filename)
+    assert cover.ref_count == 2
+
+    first, second = Book.query.order_by(Book.id).all()
+    client.post(f'/book/{first.id}/delete')
+    assert db.session.get(Cover, cover_id).ref_count == 1
+    assert os.path.exists(file_path)
+
+    client.post(f'/book/{second.id}/delete')
+    assert db.session.get(Cover, cover_id) is None
+    assert not os.path.exists(file_path)
+
+
+def test_edit_book_releases_replaced_cover(app, client, admin_user):
+    login_user(client, 'admin', 'admin123')
+    upload_book(client, make_image())
+    book = Book.query.one()
+    old_cover_id = book.cover_id
+    old_path = os.path.join(app.config['UPLOAD_FOLDER'], book.cover.filename)
+
+    client.post(f'/book/{book.id}/edit', data={
+        'title': book.title,
+        'description': book.description,
+        'year': '2021',
+        'author': book.author,
+        'publisher': book.publisher,
+        'pages': '120',
+        'cover': (make_image(color=(10, 10, 200)), 'new.png', 'image/png'),
+    }, content_type='multipart/form-data')
+
+    new_cover = db.session.get(Book, book.id).cover
+    assert new_cover.id != old_cover_id
+    assert new_cover.ref_count == 1
+    assert Cover.query.count() == 1
+    assert not os.path.exists(old_path)
+
+
+def test_negative_ref_count_keeps_shared_cover(app, client, admin_user, book):
+    second = Book(title='Вторая', description='Описание', year=2020, publisher='Издательство',
+                  author='Автор', pages=100, cover_id=book.cover_id)
+    db.session.add(second)
+    db.session.commit()
+    cover_id = book.cover_id
+    # Счётчик, разошедшийся с books, как у обложек из старой схемы
+    db.session.execute(db.update(Cover).values(ref_count=0))
+    db.session.commit()
+
+    login_user(client, 'admin', 'admin123')
+    client.post(f'/book/{book.id}/delete')
+    cover = db.session.get(Cover, cover_id)
+    assert cover is not None and cover.ref_count == -1
+    assert db.session.get(Book, second.id).cover_id == cover_id
+
+
+def test_relayout_and_recount_legacy_covers(app, runner, book):
+    cover = db.session.get(Cover, book.cover_id)
+    cover.filename = f'{cover.id}.jpg'
+    cover.ref_count = 0
+    db.session.commit()
+    with open(os.path.join(app.config['UPLOAD_FOLDER'], cover.filename), 'wb') as f:
+        f.write(b'legacy')
+
+    assert runner.invoke(args=['covers', 'recount']).exit_code == 0
+    assert runner.invoke(args=['covers', 'relayout']).exit_code == 0
+
+    db.session.expire_all()
+    h = cover.md5_hash
+    assert cover.ref_count == 1
+    assert cover.filename == f'{h[:2]}/{h[2:4]}/{h}.jpg'
+    assert os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], cover.filename))
+
+
+def _write(app, relative, data=b'x', age=7200):
+    path = os.path.join(app.config['UPLOAD_FOLDER'], relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    old = os.path.getmtime(path) - age
+    os.utime(path, (old, old))
+    return path
+
+
+def test_gc_removes_orphans(app, runner, book):
+    cover = db.session.get(Cover, book.cover_id)
+    live = _write(app, cover.filename)
+    orphan = _write(app, 'ab/cd/abcdef.jpg')
+    fresh = _write(app, 'ab/cd/fresh.jpg', age=0)
+    stale_upload = _write(app, '.upload-abc')
+    orphan_variants = _write(app, 'variants/ff/ee/ffee00/card.jpeg')
+    dangling = Cover(filename='unused.jpg', mime_type='image/jpeg', md5_hash='0' * 32)
+    db.session.add(dangling)
+    db.session.commit()
+    dangling_id = dangling.id
+
+    result = runner.invoke(args=['covers', 'gc', '--dry-run'])
+    assert result.exit_code == 0
+    assert 'Найдено: файлов 2, каталогов вариантов 1, записей 1' in result.output
+    assert os.path.exists(orphan)
+
+    result = runner.invoke(args=['covers', 'gc', '--batch-size', '1'])
+    assert result.exit_code == 0
+    assert not os.path.exists(orphan)
+    assert not os.path.exists(stale_upload)
+    assert not os.path.exists(orphan_variants)
+    assert os.path.exists(live)
+    assert os.path.exists(fresh)
+    assert db.session.get(Cover, dangling_id) is None
+    assert db.session.get(Cover, book.cover_id) is not None
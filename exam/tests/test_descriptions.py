@@ -0,0 +1,33 @@
+from app import db, Book, DESCRIPTION_RENDERER_VERSION
+from conftest import make_book
+
+
+def test_book_detail_renders_stale_description_once(client, book):
+    book.description = '**Жирный** текст'
+    db.session.commit()
+    assert book.description_html_version == 0
+
+    response = client.get(f'/book/{book.id}')
+    assert '<strong>Жирный</strong>' in response.text
+
+    book = db.session.get(Book, book.id)
+    assert book.description_html_version == DESCRIPTION_RENDERER_VERSION
+    assert book.description_html == '<p><strong>Жирный</strong> текст</p>'
+
+
+def test_rendered_description_is_sanitized(app):
+    book = make_book()
+    book.description = 'Текст <script>alert(1)</script>'
+    book.render_description()
+    assert '<script>' not in book.description_html
+
+
+def test_render_descriptions_command(runner, app):
+    books = [make_book(title=f'Книга {i}') for i in range(3)]
+    books[0].render_description()
+    db.session.commit()
+
+    result = runner.invoke(args=['books', 'render-descriptions', '--batch-size', '1'])
+    assert result.exit_code == 0
+    assert 'перерисовано описаний: 2' in result.output
+    assert Book.query.filter(Book.description_html_version != DESCRIPTION_RENDERER_VERSION).count() == 0
@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+from app import db, export_rows, Genre, Review
+from conftest import login_user, make_book
+
+
+def _seed(regular_user):
+    prose = Genre(name='Проза')
+    poetry = Genre(name='Поэзия')
+    db.session.add_all([prose, poetry])
+    rated = make_book(title='Первая', genres=[prose, poetry])
+    make_book(title='Вторая')
+    db.session.add(Review(book_id=rated.id, user_id=regular_user.id, rating=4, text='Хорошо'))
+    db.session.commit()
+
+
+def test_export_ndjson_requires_admin(client, regular_user):
+    login_user(client, 'user', 'user123')
+    response = client.get('/admin/export.ndjson')
+    assert response.status_code == 302
+
+
+def test_export_ndjson_streams_books(client, admin_user, regular_user):
+    _seed(regular_user)
+    login_user(client, 'admin', 'admin123')
+
+    response = client.get('/admin/export.ndjson')
+
+    assert response.is_streamed
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['title'] for row in rows] == ['Первая', 'Вторая']
+    assert rows[0]['genres'] == ['Поэзия', 'Проза']
+    assert (rows[0]['rating_count'], rows[0]['rating_avg']) == (1, 4.0)
+    assert (rows[1]['genres'], rows[1]['rating_avg']) == ([], None)
+
+
+def test_export_cli_csv(runner, regular_user):
+    _seed(regular_user)
+
+    result = runner.invoke(args=['books', 'export', '--format', 'csv', '--batch-size', '1'])
+
+    assert result.exit_code == 0, result.output
+    rows = list(csv.DictReader(io.StringIO(result.output)))
+    assert [row['title'] for row in rows] == ['Первая', 'Вторая']
+    assert rows[0]['genres'] == 'Поэзия;Проза'
+
+
+def test_export_orders_by_book_only(app, regular_user):
+    _seed(regular_user)
+    statements = []
+    record = lambda conn, cursor, statement, *args: statements.append(statement)
+    db.event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        rows = list(export_rows(batch_size=1))
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', record)
+
+    # Сортировка по второй таблице заставила бы MySQL сортировать весь join до первой строки
+    assert statements[-1].rstrip().endswith('ORDER BY books.id')
+    assert rows[0]['genres'] == ['Поэзия', 'Проза']
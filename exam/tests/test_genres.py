@@ -0,0 +1,78 @@
+from app import db, genre_registry, Book, Genre
+from conftest import login_user, make_book
+
+
+def _genres(*names):
+    genres = [Genre(name=name) for name in names]
+    db.session.add_all(genres)
+    db.session.commit()
+    return genres
+
+
+def test_form_reads_genres_once(client, admin_user):
+    _genres('Проза', 'Поэзия')
+    login_user(client, 'admin', 'admin123')
+
+    first = client.get('/book/add')
+    second = client.get('/book/add')
+
+    # Кроме пользователя с ролью, жанры читаются только при первом показе
+    assert first.headers['X-Query-Count'] == '2'
+    assert second.headers['X-Query-Count'] == '1'
+    assert 'Поэзия' in second.text
+
+
+def test_genre_changes_invalidate_registry(app):
+    prose, = _genres('Проза')
+    assert [entry.name for entry in genre_registry.all()] == ['Проза']
+
+    db.session.add(Genre(name='Драма'))
+    prose.name = 'Роман'
+    db.session.commit()
+
+    assert [entry.name for entry in genre_registry.all()] == ['Роман', 'Драма']
+    assert genre_registry.get(prose.id).name == 'Роман'
+
+
+def test_registry_is_reset_only_after_commit(app):
+    _genres('Проза')
+    genre_registry.all()
+
+    db.session.add(Genre(name='Драма'))
+    db.session.flush()
+    assert [entry.name for entry in genre_registry.all()] == ['Проза']
+    db.session.rollback()
+    assert [entry.name for entry in genre_registry.all()] == ['Проза']
+
+    db.session.add(Genre(name='Драма'))
+    db.session.commit()
+    assert [entry.name for entry in genre_registry.all()] == ['Проза', 'Драма']
+
+
+def test_edit_assigns_genres_with_one_query(app, client, admin_user):
+    prose, poetry, drama = _genres('Проза', 'Поэзия', 'Драма')
+    book = make_book(genres=[prose])
+    login_user(client, 'admin', 'admin123')
+    genre_registry.all()
+    book_id = book.id
+    form = {
+        'title': book.title, 'description': book.description, 'year': '2020',
+        'author': book.author, 'publisher': book.publisher, 'pages': '100',
+        'genres': [str(poetry.id), str(drama.id)],
+    }
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    db.event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        client.post(f'/book/{book_id}/edit', data=form)
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', record)
+    genre_selects = [sql for sql in statements if sql.lstrip().startswith('SELECT') and 'FROM genres' in sql
+                     and 'book_genres' not in sql]
+    assert len(genre_selects) == 1
+    assert ' IN ' in genre_selects[0]
+    assert sorted(genre.name for genre in db.session.get(Book, book.id).genres) == ['Драма', 'Поэзия']
@@ -0,0 +1,84 @@
+import hashlib
+import json
+
+from app import db, Genre, Cover, Book, ImportProgress
+from conftest import make_book
+
+
+def _write_catalog(tmp_path, count, cover_bytes=b'cover-a'):
+    (tmp_path / 'a.jpg').write_bytes(cover_bytes)
+    (tmp_path / 'b.png').write_bytes(b'cover-b')
+    path = tmp_path / 'books.jsonl'
+    with path.open('w', encoding='utf-8') as f:
+        for i in range(count):
+            f.write(json.dumps({
+                'title': f'Книга {i}', 'author': 'Автор', 'publisher': 'Издательство',
+                'year': 2000 + i, 'pages': 100, 'description': '**Описание**',
+                'genres': ['Фантастика', 'Роман'] if i % 2 else ['Роман'],
+                'cover': 'a.jpg' if i % 3 else 'b.png',
+            }, ensure_ascii=False) + '\n')
+    return path
+
+
+def test_import_jsonl_dedupes_covers_and_maps_genres(runner, tmp_path):
+    db.session.add(Genre(name='Роман'))
+    db.session.commit()
+    path = _write_catalog(tmp_path, 7)
+
+    result = runner.invoke(args=['books', 'import', str(path), '--batch-size', '3', '--commit-every', '3'])
+
+    assert result.exit_code == 0, result.output
+    assert Book.query.count() == 7
+    assert Genre.query.count() == 2
+    covers = {cover.md5_hash: cover for cover in Cover.query.all()}
+    assert sorted(cover.ref_count for cover in covers.values()) == [3, 4]
+    book = Book.query.filter_by(title='Книга 1').one()
+    assert sorted(genre.name for genre in book.genres) == ['Роман', 'Фантастика']
+    assert '<strong>Описание</strong>' in book.description_html
+    assert db.session.get(ImportProgress, str(path)).offset == 7
+
+
+def test_import_reuses_existing_cover_by_hash(runner, tmp_path):
+    existing = make_book()
+    cover = existing.cover
+    path = _write_catalog(tmp_path, 2)
+    cover.md5_hash = hashlib.md5(b'cover-a').hexdigest()
+    db.session.commit()
+
+    result = runner.invoke(args=['books', 'import', str(path)])
+
+    assert result.exit_code == 0, result.output
+    assert Cover.query.count() == 2
+    assert Book.query.filter_by(cover_id=cover.id).count() == 2
+
+
+def test_import_resumes_from_committed_offset(runner, tmp_path):
+    path = _write_catalog(tmp_path, 5)
+    db.session.add(ImportProgress(source=str(path), offset=3))
+    db.session.commit()
+
+    result = runner.invoke(args=['books', 'import', str(path)])
+
+    assert result.exit_code == 0, result.output
+    assert sorted(book.title for book in Book.query.all()) == ['Книга 3', 'Книга 4']
+
+    result = runner.invoke(args=['books', 'import', str(path), '--restart'])
+    assert Book.query.count() == 7
+
+
+def test_import_csv_skips_invalid_rows(runner, tmp_path):
+    (tmp_path / 'a.jpg').write_bytes(b'cover-a')
+    path = tmp_path / 'books.csv'
+    path.write_text(
+        'title,author,publisher,year,pages,description,genres,cover\n'
+        'Первая,Автор,Изд,2001,10,,Роман; Поэзия,a.jpg\n'
+        'Вторая,Автор,Изд,не год,10,,,a.jpg\n'
+        'Третья,Автор,Изд,2003,10,,,missing.jpg\n',
+        encoding='utf-8',
+    )
+
+    result = runner.invoke(args=['books', 'import', str(path)])
+
+    assert result.exit_code == 0, result.output
+    assert [book.title for book in Book.query.all()] == ['Первая']
+    assert sorted(genre.name for genre in Genre.query.all()) == ['Поэзия', 'Роман']
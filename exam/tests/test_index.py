@@ -0,0 +1,75 @@
+import re
+
+from app import db, Genre, Review, _catalog_count_cache
+from conftest import make_book, make_user
+
+
+def _seed(count, reviewer, genres):
+    for i in range(count):
+        book = make_book(title=f'Книга {i}', year=2000 + i, genres=genres)
+        db.session.add(Review(book_id=book.id, user_id=reviewer.id, rating=1 + i % 5, text='ok'))
+    db.session.commit()
+
+
+def test_index_query_count_is_constant(client, roles):
+    reviewer = make_user('reviewer', roles['user'])
+    genres = [Genre(name=f'Жанр {i}') for i in range(3)]
+    db.session.add_all(genres)
+    _seed(2, reviewer, genres)
+    small = client.get('/')
+    assert small.status_code == 200
+
+    _seed(12, reviewer, genres)
+    large = client.get('/')
+    assert large.status_code == 200
+    assert int(large.headers['X-Query-Count']) == int(small.headers['X-Query-Count'])
+    assert int(large.headers['X-Query-Count']) <= 4
+
+
+
+def _titles(response):
+    return re.findall(r'<h5 class="card-title">(.*?)</h5>', response.text)
+
+
+def _cursor(response, label):
+    found = re.findall(rf'cursor=([\w-]+)">{label}', response.text)
+    return found[0] if found else None
+
+
+def test_cursor_pagination_walks_catalog(app, client):
+    for i in range(25):
+        make_book(title=f'Книга {i:02d}', year=2000 + i % 3)
+    app.config['CATALOG_PAGINATION'] = 'cursor'
+    try:
+        pages = [client.get('/')]
+        while _cursor(pages[-1], 'Следующая'):
+            pages.append(client.get(f"/?cursor={_cursor(pages[-1], 'Следующая')}"))
+
+        titles = [title for page in pages for title in _titles(page)]
+        assert len(pages) == 3
+        assert len(set(titles)) == 25
+        assert _cursor(pages[0], 'Предыдущая') is None
+
+        previous = client.get(f"/?cursor={_cursor(pages[-1], 'Предыдущая')}")
+        assert _titles(previous) == _titles(pages[1])
+    finally:
+        app.config['CATALOG_PAGINATION'] = 'offset'
+
+
+def test_invalid_cursor_falls_back_to_first_page(client, book):
+    response = client.get('/?cursor=not-a-cursor')
+    assert response.status_code == 200
+    assert _titles(response) == [book.title]
+
+
+def test_cached_catalog_count_skips_count_query(app, client):
+    make_book()
+    _catalog_count_cache.clear()
+    app.config['CATALOG_COUNT_MODE'] = 'cached'
+    try:
+        first = client.get('/')
+        second = client.get('/')
+        assert int(second.headers['X-Query-Count']) == int(first.headers['X-Query-Count']) - 1
+    finally:
+        app.config['CATALOG_COUNT_MODE'] = 'exact'
+        _catalog_count_cache.clear()
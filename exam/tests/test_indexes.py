@@ -0,0 +1,31 @@
+from sqlalchemy import inspect
+
+from app import db, Book
+from check_indexes import check, full_scans
+
+
+def test_route_queries_use_indexes(app, capsys):
+    with db.engine.connect() as connection:
+        assert check(connection) == 0
+    assert 'FAIL' not in capsys.readouterr().out
+
+
+def test_full_scan_is_reported(app):
+    with db.engine.connect() as connection:
+        assert full_scans(connection, db.select(Book.id).where(Book.pages == 100)) == ['books']
+
+
+def test_models_declare_hot_path_indexes(app):
+    inspector = inspect(db.engine)
+    indexed = {
+        (table, tuple(index['column_names']))
+        for table in ('reviews', 'collections', 'books', 'book_genres')
+        for index in inspector.get_indexes(table)
+    }
+    assert {
+        ('reviews', ('book_id', 'created_at')),
+        ('reviews', ('user_id',)),
+        ('collections', ('user_id', 'created_at')),
+        ('books', ('year', 'id')),
+        ('book_genres', ('genre_id',)),
+    } <= indexed
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+
+from werkzeug.datastructures import FileStorage
+
+from app import db, get_io_queue, store_cover, Cover
+from cover_variants import variant_path
+from io_worker import IOQueue, job, unfinished_jobs
+from test_covers import make_image
+
+calls = []
+gates = {}
+
+
+@job('test_flaky')
+def flaky_job(queue, name, failures):
+    calls.append(name)
+    if calls.count(name) <= failures:
+        raise OSError('диск занят')
+
+
+@job('test_gated')
+def gated_job(queue, gate):
+    gates[gate].wait(5)
+
+
+def test_retries_then_records_completion(tmp_path):
+    calls.clear()
+    queue = IOQueue(str(tmp_path), workers=0, max_attempts=3).start()
+    queue.submit('test_flaky', name='a', failures=2)
+    queue.submit('test_flaky', name='b', failures=5)
+
+    assert calls.count('a') == 3 and calls.count('b') == 3
+    assert (queue.completed, queue.failed, queue.pending()) == (1, 1, 0)
+    queue.shutdown()
+
+
+def test_unfinished_jobs_of_dead_process_are_replayed(tmp_path):
+    calls.clear()
+    with open(tmp_path / 'journal-999999.jsonl', 'w', encoding='utf-8') as f:
+        for job_id, name in (('1', 'done'), ('2', 'lost')):
+            f.write(json.dumps({'id': job_id, 'job': 'test_flaky', 'args': {'name': name, 'failures': 0}}) + '\n')
+        f.write(json.dumps({'id': '1', 'done': True}) + '\n')
+        f.write('{"id": "3", "jo')
+
+    queue = IOQueue(str(tmp_path), workers=0).start()
+    queue.replay_orphans()
+
+    assert calls == ['lost']
+    assert os.listdir(tmp_path) == [f'journal-{os.getpid()}.jsonl']
+    queue.shutdown()
+
+
+def test_journal_keeps_job_until_it_finishes(tmp_path):
+    queue = IOQueue(str(tmp_path), workers=0, max_attempts=1).start()
+    queue._finish = lambda job_id, failed=False: None
+    queue.submit('test_flaky', name='c', failures=0)
+
+    with open(tmp_path / f'journal-{os.getpid()}.jsonl', encoding='utf-8') as f:
+        assert [entry['args']['name'] for entry in unfinished_jobs(f)] == ['c']
+    queue.shutdown()
+
+
+def test_finish_does_not_truncate_job_being_submitted(tmp_path):
+    gates.update(a=threading.Event(), b=threading.Event())
+    queue = IOQueue(str(tmp_path), workers=2).start()
+    queue.submit('test_gated', gate='a')
+    write = queue._write
+
+    def write_then_finish_a(record):
+        write(record)
+        if record.get('args') == {'gate': 'b'}:
+            # Задание a завершается, пока b записано в журнал, но ещё не учтено
+            gates['a'].set()
+            time.sleep(0.2)
+
+    queue._write = write_then_finish_a
+    queue.submit('test_gated', gate='b')
+    time.sleep(0.1)
+
+    with open(tmp_path / f'journal-{os.getpid()}.jsonl', encoding='utf-8') as f:
+        assert [entry['args']['gate'] for entry in unfinished_jobs(f)] == ['b']
+    gates['b'].set()
+    queue.shutdown()
+
+
+def test_cover_file_appears_only_after_commit(app):
+    cover = store_cover(FileStorage(make_image(), filename='cover.png', content_type='image/png'))
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], cover.filename)
+    assert not os.path.exists(file_path)
+
+    db.session.commit()
+
+    assert os.path.exists(file_path)
+    assert get_io_queue().pending() == 0
+
+
+def test_rollback_discards_upload(app):
+    store_cover(FileStorage(make_image(), filename='cover.png', content_type='image/png'))
+    db.session.rollback()
+
+    assert Cover.query.count() == 0
+    leftovers = [name for _, _, names in os.walk(app.config['UPLOAD_FOLDER']) for name in names]
+    assert leftovers == []
+
+
+def test_stale_remove_keeps_reuploaded_cover(app):
+    cover = store_cover(FileStorage(make_image(), filename='cover.png', content_type='image/png'))
+    db.session.commit()
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], cover.filename)
+
+    # Задание от прошлого освобождения той же картинки, выполненное после повторной загрузки
+    get_io_queue().submit('remove_cover', upload_folder=app.config['UPLOAD_FOLDER'],
+                          filename=cover.filename, md5_hash=cover.md5_hash)
+
+    assert os.path.exists(file_path)
+    assert os.path.exists(variant_path(app.config['UPLOAD_FOLDER'], cover.md5_hash, 'card', 'webp'))
+
+
+def test_persist_cover_replayed_on_first_request(app, client):
+    # Обложка закоммичена, а процесс упал до переноса загрузки на место
+    upload_folder = app.config['UPLOAD_FOLDER']
+    tmp_path = os.path.join(upload_folder, '.upload-crashed')
+    with open(tmp_path, 'wb') as f:
+        f.write(make_image().getvalue())
+    cover = Cover(filename='ab/cd/abcd.png', mime_type='image/png', md5_hash='abcd')
+    db.session.add(cover)
+    db.session.commit()
+    with open(os.path.join(app.config['IO_JOURNAL_DIR'], 'journal-999999.jsonl'), 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'id': '1', 'job': 'persist_cover', 'args': {
+            'upload_folder': upload_folder, 'tmp_path': tmp_path, 'filename': cover.filename, 'md5_hash': 'abcd',
+        }}) + '\n')
+
+    response = client.get(f'/cover/{cover.id}')
+
+    assert response.status_code == 200
+    assert not os.path.exists(tmp_path)
+    assert os.path.exists(variant_path(upload_folder, 'abcd', 'card', 'webp'))
+    assert os.listdir(app.config['IO_JOURNAL_DIR']) == [f'journal-{os.getpid()}.jsonl']
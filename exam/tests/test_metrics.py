@@ -0,0 +1,48 @@
+import re
+
+from metrics import Histogram, Registry
+
+
+def _sample(text, name, **labels):
+    label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf'^{re.escape(name)}{{{re.escape(label_text)}}} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else None
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(Histogram('latency', 'Задержка', ('endpoint',), buckets=(0.1, 1.0)))
+    histogram.observe(0.05, ('index',))
+    histogram.observe(0.5, ('index',))
+    histogram.observe(3.0, ('index',))
+
+    text = registry.render()
+
+    assert '# TYPE latency histogram' in text
+    assert _sample(text, 'latency_bucket', endpoint='index', le='0.1') == 1
+    assert _sample(text, 'latency_bucket', endpoint='index', le='1.0') == 2
+    assert _sample(text, 'latency_bucket', endpoint='index', le='+Inf') == 3
+    assert _sample(text, 'latency_sum', endpoint='index') == 3.55
+
+
+def test_server_timing_header(client, book):
+    response = client.get(f'/book/{book.id}')
+
+    timing = dict(re.findall(r'(\w+);dur=([\d.]+)', response.headers['Server-Timing']))
+    assert set(timing) == {'db', 'render', 'total'}
+    assert float(timing['total']) >= max(float(timing['db']), float(timing['render']))
+
+
+def test_metrics_endpoint_reports_routes(client, book):
+    client.get('/')
+    client.get('/')
+    client.get('/no-such-page')
+
+    response = client.get('/metrics')
+
+    assert response.mimetype == 'text/plain'
+    text = response.text
+    assert _sample(text, 'flask_request_duration_seconds_count', endpoint='index', method='GET') >= 2
+    assert _sample(text, 'flask_request_sql_statements_sum', endpoint='index') > 0
+    assert _sample(text, 'flask_requests_total', endpoint='unmatched', method='GET', status='404') >= 1
+    assert _sample(text, 'flask_response_size_bytes_count', endpoint='index') >= 2
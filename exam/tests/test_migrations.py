@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+EXAM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Схема до оптимизаций - в таком виде она есть в уже работающих базах
+BASELINE_SCHEMA = """
+CREATE TABLE roles (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL UNIQUE, description TEXT NOT NULL);
+CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(50) NOT NULL UNIQUE, password_hash VARCHAR(255) NOT NULL,
+                    first_name VARCHAR(100) NOT NULL, last_name VARCHAR(100) NOT NULL, middle_name VARCHAR(100),
+                    role_id INTEGER NOT NULL REFERENCES roles (id));
+CREATE TABLE genres (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL UNIQUE);
+CREATE TABLE covers (id INTEGER PRIMARY KEY, filename VARCHAR(255) NOT NULL, mime_type VARCHAR(100) NOT NULL,
+                     md5_hash VARCHAR(32) NOT NULL UNIQUE);
+CREATE TABLE books (id INTEGER PRIMARY KEY, title VARCHAR(255) NOT NULL, description TEXT NOT NULL, year INTEGER NOT NULL,
+                    publisher VARCHAR(255) NOT NULL, author VARCHAR(255) NOT NULL, pages INTEGER NOT NULL,
+                    cover_id INTEGER NOT NULL REFERENCES covers (id));
+CREATE TABLE book_genres (book_id INTEGER NOT NULL REFERENCES books (id), genre_id INTEGER NOT NULL REFERENCES genres (id),
+                          PRIMARY KEY (book_id, genre_id));
+CREATE TABLE reviews (id INTEGER PRIMARY KEY, book_id INTEGER NOT NULL REFERENCES books (id),
+                      user_id INTEGER NOT NULL REFERENCES users (id), rating INTEGER NOT NULL, text TEXT NOT NULL,
+                      created_at DATETIME NOT NULL, CONSTRAINT unique_user_book_review UNIQUE (book_id, user_id));
+CREATE TABLE collections (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, user_id INTEGER NOT NULL REFERENCES users (id),
+                          created_at DATETIME NOT NULL);
+CREATE TABLE collection_books (collection_id INTEGER NOT NULL REFERENCES collections (id),
+                               book_id INTEGER NOT NULL REFERENCES books (id), PRIMARY KEY (collection_id, book_id));
+
+INSERT INTO roles VALUES (1, 'пользователь', 'Читатель');
+INSERT INTO users VALUES (1, 'anna', 'x', 'Анна', 'А', NULL, 1), (2, 'boris', 'x', 'Борис', 'Б', NULL, 1);
+INSERT INTO covers VALUES (1, 'shared.jpg', 'image/jpeg', 'aaaa'), (2, 'own.jpg', 'image/jpeg', 'bbbb');
+INSERT INTO books VALUES (1, 'Первая', 'Описание', 2020, 'Изд', 'Автор', 100, 1),
+                         (2, 'Вторая', 'Описание', 2021, 'Изд', 'Автор', 100, 1),
+                         (3, 'Третья', 'Описание', 2022, 'Изд', 'Автор', 100, 2);
+INSERT INTO reviews VALUES (1, 1, 1, 5, 'a', '2026-01-01 00:00:00'), (2, 1, 2, 2, 'b', '2026-01-02 00:00:00');
+"""
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    path = tmp_path / 'baseline.db'
+    with sqlite3.connect(path) as connection:
+        connection.executescript(BASELINE_SCHEMA)
+    return path
+
+
+def flask_db(path, *args):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', FLASK_APP='app.py', RESPONSE_CACHE='off')
+    result = subprocess.run([sys.executable, '-m', 'flask', 'db', *args], cwd=EXAM_DIR, env=env,
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+def test_upgrade_backfills_rating_aggregates(baseline_db):
+    flask_db(baseline_db, 'upgrade')
+
+    with sqlite3.connect(baseline_db) as connection:
+        rows = connection.execute(
+            'SELECT id, rating_count, rating_sum, rating_avg, rating_5, rating_2 FROM books ORDER BY id'
+        ).fetchall()
+    assert rows == [(1, 2, 7, 3.5, 1, 1), (2, 0, 0, None, 0, 0), (3, 0, 0, None, 0, 0)]
+
+
+def test_upgrade_backfills_cover_ref_count(baseline_db):
+    flask_db(baseline_db, 'upgrade')
+
+    with sqlite3.connect(baseline_db) as connection:
+        rows = connection.execute('SELECT id, ref_count FROM covers ORDER BY id').fetchall()
+    assert rows == [(1, 2), (2, 1)]
+
+
+def test_upgrade_marks_descriptions_for_rendering(baseline_db):
+    flask_db(baseline_db, 'upgrade')
+
+    with sqlite3.connect(baseline_db) as connection:
+        rows = connection.execute('SELECT DISTINCT description_html, description_html_version FROM books').fetchall()
+    assert rows == [(None, 0)]
+
+
+def test_upgrade_builds_search_index(baseline_db):
+    flask_db(baseline_db, 'upgrade')
+
+    with sqlite3.connect(baseline_db) as connection:
+        found = connection.execute("SELECT rowid FROM books_fts WHERE books_fts MATCH '\"Вторая\"'").fetchall()
+    assert found == [(2,)]
+
+
+def test_upgraded_baseline_serves_pages(baseline_db):
+    flask_db(baseline_db, 'upgrade')
+
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{baseline_db}', RESPONSE_CACHE='off', IO_WORKERS='0')
+    script = (
+        'from app import app, db, ImportProgress\n'
+        'client = app.test_client()\n'
+        'for url in ("/", "/book/1", "/search?q=Вторая"):\n'
+        '    assert client.get(url).status_code == 200, url\n'
+        'with app.app_context():\n'
+        '    db.session.add(ImportProgress(source="catalog.jsonl", offset=1))\n'
+        '    db.session.commit()\n'
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=EXAM_DIR, env=env, check=True)
+
+
+def test_upgrade_is_idempotent_for_created_schema(tmp_path):
+    path = tmp_path / 'fresh.db'
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}')
+    subprocess.run([sys.executable, '-c', 'from app import app, db\nwith app.app_context(): db.create_all()'],
+                   cwd=EXAM_DIR, env=env, check=True)
+    flask_db(path, 'upgrade')
+    assert 'head' in flask_db(path, 'current').stdout
@@ -0,0 +1,123 @@
+import pytest
+
+from app import db, Book, Genre, Review
+from conftest import login_user, make_book
+from response_cache import FileBackend, MemoryLRUBackend
+
+
+@pytest.fixture(params=['memory', 'file'])
+def page_cache(app, tmp_path, request):
+    app.config['RESPONSE_CACHE'] = request.param
+    app.config['RESPONSE_CACHE_DIR'] = str(tmp_path / 'page-cache')
+    app.extensions.pop('response_cache', None)
+    yield
+    app.config['RESPONSE_CACHE'] = 'off'
+    app.extensions.pop('response_cache', None)
+
+
+def _book(**kwargs):
+    # Описание рендерится заранее, иначе первый просмотр сам изменит книгу
+    book = make_book(**kwargs)
+    book.render_description()
+    db.session.commit()
+    return book
+
+
+def test_anonymous_pages_are_served_from_cache(client, page_cache):
+    book = _book()
+    first = client.get(f'/book/{book.id}')
+    second = client.get(f'/book/{book.id}')
+
+    assert first.headers['X-Cache'] == 'MISS'
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.headers['X-Query-Count'] == '0'
+    assert second.text == first.text
+
+
+def test_logged_in_users_bypass_cache(client, regular_user, page_cache):
+    login_user(client, 'user', 'user123')
+    client.get('/')
+    assert 'X-Cache' not in client.get('/').headers
+
+
+def test_review_bumps_book_and_catalog_versions(client, regular_user, page_cache):
+    book = _book()
+    other = _book(title='Другая')
+    for url in ('/', f'/book/{book.id}', f'/book/{other.id}'):
+        client.get(url)
+
+    db.session.add(Review(book_id=book.id, user_id=regular_user.id, rating=5, text='Отлично'))
+    db.session.commit()
+
+    assert client.get('/').headers['X-Cache'] == 'MISS'
+    assert client.get(f'/book/{book.id}').headers['X-Cache'] == 'MISS'
+    assert client.get(f'/book/{other.id}').headers['X-Cache'] == 'HIT'
+
+
+def test_book_edit_and_genre_rename_invalidate(client, page_cache):
+    genre = Genre(name='Проза')
+    book = _book(genres=[genre])
+    client.get(f'/book/{book.id}')
+
+    db.session.get(Book, book.id).title = 'Новое название'
+    db.session.commit()
+    response = client.get(f'/book/{book.id}')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert 'Новое название' in response.text
+
+    db.session.get(Genre, genre.id).name = 'Роман'
+    db.session.commit()
+    response = client.get(f'/book/{book.id}')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert 'Роман' in response.text
+
+
+def test_description_render_keeps_cached_pages(client, page_cache):
+    book = make_book()
+    client.get('/')
+
+    # Первый просмотр сам перерисовывает описание и сохраняет книгу
+    assert client.get(f'/book/{book.id}').headers['X-Cache'] == 'MISS'
+    assert client.get(f'/book/{book.id}').headers['X-Cache'] == 'HIT'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+    db.session.get(Book, book.id).pages = 500
+    db.session.commit()
+    assert client.get(f'/book/{book.id}').headers['X-Cache'] == 'MISS'
+    assert client.get('/').headers['X-Cache'] == 'HIT'
+
+
+def test_commands_invalidate_file_cache_and_warn_about_memory(app, client, runner, page_cache):
+    _book()
+    client.get('/')
+
+    result = runner.invoke(args=['books', 'rebuild-ratings'])
+    assert result.exit_code == 0, result.output
+    if app.config['RESPONSE_CACHE'] == 'file':
+        assert client.get('/').headers['X-Cache'] == 'MISS'
+        assert 'RESPONSE_CACHE=memory' not in result.output
+    else:
+        assert 'RESPONSE_CACHE=memory' in result.output
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryLRUBackend(max_bytes=10)
+    backend.set('a', b'aaaa')
+    backend.set('b', b'bbbb')
+    backend.get('a')
+    backend.set('c', b'cccc')
+
+    assert backend.get('b') is None
+    assert backend.get('a') == b'aaaa'
+    assert backend.get('c') == b'cccc'
+
+
+def test_file_backend_respects_size_limit(tmp_path):
+    backend = FileBackend(str(tmp_path), max_bytes=100)
+    for i in range(10):
+        backend.set(f'page-{i}', b'x' * 30)
+
+    assert backend.get('page-9') == b'x' * 30
+    assert backend._disk_size() <= 100
+    backend.bump_version('catalog')
+    assert backend.get_version('catalog') != '0'
@@ -0,0 +1,43 @@
+import pytest
+from sqlalchemy import create_engine, exc
+
+from app import db
+from db_pool import InstrumentedQueuePool, engine_options, pool_status
+from conftest import login_user
+
+
+def test_engine_uses_instrumented_pool(app):
+    assert isinstance(db.engine.pool, InstrumentedQueuePool)
+
+
+def test_engine_options_from_environment():
+    options = engine_options('mysql+pymysql://u@h/db', {'DB_POOL_SIZE': '12', 'DB_POOL_PRE_PING': '0'})
+    assert options['pool_size'] == 12
+    assert options['pool_pre_ping'] is False
+    assert engine_options('sqlite://', {}) == {}
+
+
+def test_pool_counts_timeouts_and_waits(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/pool.db', poolclass=InstrumentedQueuePool,
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    held = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    status = pool_status(engine.pool)
+    held.close()
+
+    assert status['checked_out'] == 1
+    assert status['timeouts'] == 1
+    assert status['wait_max_ms'] >= 50
+    engine.dispose()
+
+
+def test_pool_endpoint_requires_admin(client, admin_user, regular_user):
+    login_user(client, 'user', 'user123')
+    assert client.get('/admin/pool').status_code == 302
+
+    client.get('/logout')
+    login_user(client, 'admin', 'admin123')
+    data = client.get('/admin/pool').get_json()
+    assert data['pool_class'] == 'InstrumentedQueuePool'
+    assert {'checked_out', 'overflow', 'checkouts', 'wait_avg_ms'} <= data.keys()
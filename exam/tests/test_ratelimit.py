@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import User
+from conftest import login_user
+from ratelimit import LoginLimiter, MemoryBackend, SQLiteBackend
+
+EXAM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteBackend(str(tmp_path / 'limits.sqlite3'))
+    return MemoryBackend()
+
+
+def test_bucket_refills_over_time(backend):
+    results = [backend.consume('ip:1', 2, 10, now) for now in (0, 0, 0, 5, 5)]
+
+    assert [allowed for allowed, _ in results] == [True, True, False, True, False]
+    assert results[2][1] == pytest.approx(5)
+
+
+def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryBackend(max_keys=3)
+    for now, key in enumerate(('a', 'b', 'c')):
+        backend.consume(key, 1, 60, now)
+    backend.consume('a', 1, 60, 3)
+    backend.consume('d', 1, 60, 4)
+
+    assert list(backend._buckets) == ['c', 'a', 'd']
+    # Протухшие корзины уходят и без переполнения
+    backend.consume('e', 1, 60, 62.5)
+    assert list(backend._buckets) == ['a', 'd', 'e']
+
+
+def test_ip_limit_does_not_spend_username_tokens(backend):
+    limiter = LoginLimiter(backend, ip_rate=(1, 60), user_rate=(2, 60))
+
+    results = [limiter.check(ip, username)[0] for ip, username in (
+        ('10.0.0.1', 'admin'), ('10.0.0.1', 'admin'), ('10.0.0.2', 'Admin '), ('10.0.0.3', 'admin'),
+    )]
+
+    assert results == ['allowed', 'limited_ip', 'allowed', 'limited_user']
+    assert limiter.counters == {'allowed': 2, 'limited_ip': 1, 'limited_user': 1}
+
+
+def test_login_is_rejected_before_password_check(app, client, regular_user, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_USER_RATE', '2/60')
+    checked = []
+    monkeypatch.setattr(User, 'check_password', lambda self, password: checked.append(password) or False)
+
+    statuses = [client.post('/login', data={'username': 'user', 'password': 'wrong'}).status_code for _ in range(4)]
+
+    assert statuses == [200, 200, 429, 429]
+    assert len(checked) == 2
+    rejected = client.post('/login', data={'username': 'user', 'password': 'wrong'})
+    assert rejected.headers['X-Query-Count'] == '0'
+    assert int(rejected.headers['Retry-After']) > 0
+    assert 'login_attempts_total{result="limited_user"} 3' in client.get('/metrics').text
+
+
+def test_successful_login_still_works(client, regular_user):
+    login_user(client, 'user', 'user123')
+    with client.session_transaction() as session:
+        assert session['user_id'] == regular_user.id
+
+
+def test_ip_bucket_uses_forwarded_address_behind_trusted_proxy(tmp_path):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{tmp_path / "proxy.db"}', TRUSTED_PROXIES='1',
+               LOGIN_IP_RATE='1/60', LOGIN_USER_RATE='10/60')
+    script = (
+        'from app import app, db\n'
+        'with app.app_context():\n'
+        '    db.create_all()\n'
+        'client = app.test_client()\n'
+        'def attempt(ip):\n'
+        '    return client.post("/login", data={"username": "x", "password": "y"},\n'
+        '                       headers={"X-Forwarded-For": ip}).status_code\n'
+        'assert attempt("203.0.113.1") != 429\n'
+        'assert attempt("203.0.113.2") != 429\n'
+        'assert attempt("203.0.113.1") == 429\n'
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=EXAM_DIR, env=env, check=True)
@@ -0,0 +1,81 @@
+from app import db, Book, Review
+from conftest import login_user, make_user
+
+
+def test_add_review_updates_aggregates(client, book, regular_user):
+    login_user(client, 'user', 'user123')
+    client.post(f'/book/{book.id}/review', data={'rating': '4', 'text': 'Хорошо'})
+
+    book = db.session.get(Book, book.id)
+    assert book.rating_count == 1
+    assert book.rating_sum == 4
+    assert book.average_rating == 4
+
+
+def test_review_delete_updates_aggregates(app, book, roles):
+    first = make_user('first', roles['user'])
+    second = make_user('second', roles['user'])
+    db.session.add_all([
+        Review(book_id=book.id, user_id=first.id, rating=5, text='a'),
+        Review(book_id=book.id, user_id=second.id, rating=2, text='b'),
+    ])
+    db.session.commit()
+    assert (book.rating_count, book.rating_sum, book.average_rating) == (2, 7, 3.5)
+
+    db.session.delete(Review.query.filter_by(user_id=first.id).one())
+    db.session.commit()
+    assert (book.rating_count, book.rating_sum, book.average_rating) == (1, 2, 2)
+
+
+def test_rebuild_ratings_fixes_drift(runner, book, regular_user):
+    db.session.add(Review(book_id=book.id, user_id=regular_user.id, rating=3, text='a'))
+    db.session.commit()
+    db.session.execute(db.update(Book).values(rating_count=0, rating_sum=0, rating_avg=None))
+    db.session.commit()
+
+    result = runner.invoke(args=['books', 'rebuild-ratings', '--check'])
+    assert result.exit_code == 1
+    assert 'Книг с расхождениями: 1' in result.output
+
+    result = runner.invoke(args=['books', 'rebuild-ratings'])
+    assert result.exit_code == 0
+    db.session.expire_all()
+    assert (book.rating_count, book.rating_sum, book.average_rating) == (1, 3, 3)
+    assert runner.invoke(args=['books', 'rebuild-ratings', '--check']).exit_code == 0
+
+
+def test_review_updates_star_counts(client, book, roles):
+    for username, rating in (('first', 5), ('second', 5), ('third', 2)):
+        make_user(username, roles['user'])
+        login_user(client, username, f'{username}123')
+        client.post(f'/book/{book.id}/review', data={'rating': str(rating), 'text': 'Отзыв'})
+        client.get('/logout')
+
+    book = db.session.get(Book, book.id)
+    assert book.rating_distribution == {5: 2, 4: 0, 3: 0, 2: 1, 1: 0}
+
+    response = client.get(f'/api/book/{book.id}/ratings')
+    assert response.get_json() == {
+        'book_id': book.id, 'count': 3, 'average': 4.0,
+        'distribution': {'1': 0, '2': 1, '3': 0, '4': 0, '5': 2},
+    }
+    assert response.headers['X-Query-Count'] == '1'
+    assert client.get(f'/api/book/{book.id}/ratings', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    page = client.get(f'/book/{book.id}').text
+    assert 'rating-distribution' in page
+
+
+def test_rebuild_ratings_fixes_star_counts(runner, book, regular_user):
+    db.session.add(Review(book_id=book.id, user_id=regular_user.id, rating=4, text='a'))
+    db.session.commit()
+    db.session.execute(db.update(Book).values(rating_4=0, rating_1=2))
+    db.session.commit()
+
+    result = runner.invoke(args=['books', 'rebuild-ratings', '--check'])
+    assert result.exit_code == 1
+    assert '[0/0/0/1/0]' in result.output
+
+    assert runner.invoke(args=['books', 'rebuild-ratings']).exit_code == 0
+    db.session.expire_all()
+    assert book.rating_distribution == {5: 0, 4: 1, 3: 0, 2: 0, 1: 0}
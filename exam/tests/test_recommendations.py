@@ -0,0 +1,97 @@
+import pytest
+
+from app import db, Review, BookSimilar, RecommendationRun
+from conftest import make_book, make_user
+from recommendations import RatingMatrix, affected_books
+
+
+def _matrix(triples):
+    users, books, ratings = zip(*triples)
+    return RatingMatrix(users, books, ratings)
+
+
+def test_neighbours_ranked_by_cosine():
+    matrix = _matrix([
+        (1, 10, 5), (1, 20, 3),
+        (2, 10, 4), (2, 20, 4), (2, 30, 1),
+        (3, 30, 5), (3, 40, 5),
+    ])
+    result = dict(matrix.neighbours(matrix.columns([10, 30, 40]), k=2, batch_size=2))
+
+    assert [book_id for book_id, _ in result[10]] == [20, 30]
+    assert result[10][0][1] == pytest.approx(31 / (41 ** 0.5 * 5))
+    assert [book_id for book_id, _ in result[30]] == [40, 20]
+    # Без общих читателей книги не считаются похожими
+    assert [book_id for book_id, _ in result[40]] == [30]
+
+
+def test_columns_skip_books_without_ratings():
+    matrix = _matrix([(1, 10, 5), (1, 30, 3)])
+    assert matrix.book_ids[matrix.columns([30, 20, 99, 10])].tolist() == [30, 10]
+
+
+def test_affected_books_only_where_lists_can_change():
+    matrix = _matrix([(1, 10, 5), (1, 20, 5), (2, 30, 5), (2, 40, 5), (3, 50, 5)])
+    current = {10: [(20, 1.0)], 20: [(10, 1.0)], 30: [(40, 1.0)], 40: [(30, 1.0)]}
+
+    assert affected_books(matrix, {20}, current, k=1) == {10, 20}
+    assert affected_books(matrix, {50}, current, k=1) == {50}
+
+
+def _rate(user, *ratings):
+    db.session.add_all(Review(book_id=book.id, user_id=user.id, rating=rating, text='x') for book, rating in ratings)
+    db.session.commit()
+
+
+def _similar(book):
+    return db.session.execute(
+        db.select(BookSimilar.similar_book_id).where(BookSimilar.book_id == book.id).order_by(BookSimilar.rank)
+    ).scalars().all()
+
+
+def test_recommend_full_then_incremental(runner, roles):
+    first, second, third, fourth, fifth, sixth = (
+        make_book(title) for title in ('Первая', 'Вторая', 'Третья', 'Четвёртая', 'Пятая', 'Шестая')
+    )
+    _rate(make_user('anna', roles['user']), (first, 5), (second, 5))
+    _rate(make_user('boris', roles['user']), (third, 4), (fourth, 4))
+    _rate(make_user('gleb', roles['user']), (fifth, 3), (sixth, 3))
+
+    result = runner.invoke(args=['books', 'recommend'])
+    assert result.exit_code == 0, result.output
+    assert 'полностью' in result.output
+    assert _similar(first) == [second.id]
+    assert _similar(third) == [fourth.id]
+
+    # Новые оценки связывают первую и третью книги; пятой и шестой они не касаются
+    _rate(make_user('vera', roles['user']), (first, 5), (third, 5))
+    result = runner.invoke(args=['books', 'recommend'])
+    assert result.exit_code == 0, result.output
+    assert 'инкрементально' in result.output
+    assert _similar(first) == [second.id, third.id]
+    assert _similar(third) == [fourth.id, first.id]
+    assert _similar(fifth) == [sixth.id]
+    runs = RecommendationRun.query.order_by(RecommendationRun.id).all()
+    assert [(run.full, run.books_updated) for run in runs] == [(True, 6), (False, 4)]
+
+
+def test_book_page_shows_similar_books(client, runner, roles):
+    first, second = make_book('Первая'), make_book('Вторая')
+    first.render_description()
+    db.session.commit()
+    _rate(make_user('anna', roles['user']), (first, 5), (second, 4))
+    runner.invoke(args=['books', 'recommend'])
+
+    response = client.get(f'/book/{first.id}')
+    assert 'Читатели также оценили' in response.get_data(as_text=True)
+    assert f'/book/{second.id}"' in response.get_data(as_text=True)
+
+
+def test_deleting_book_drops_its_similar_rows(runner, roles):
+    first, second = make_book('Первая'), make_book('Вторая')
+    _rate(make_user('anna', roles['user']), (first, 5), (second, 4))
+    runner.invoke(args=['books', 'recommend'])
+
+    db.session.delete(second)
+    db.session.commit()
+    assert BookSimilar.query.count() == 0
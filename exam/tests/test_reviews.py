@@ -0,0 +1,67 @@
+import re
+from datetime import datetime, timedelta
+
+from app import db, Review, REVIEWS_PER_PAGE
+from conftest import login_user, make_user
+
+
+def _seed_reviews(book, roles, count):
+    start = datetime(2024, 1, 1)
+    users = [make_user(f'reader{i}', roles['user']) for i in range(count)]
+    db.session.add_all([
+        Review(book_id=book.id, user_id=user.id, rating=1 + i % 5, text=f'Отзыв {i}',
+               created_at=start + timedelta(minutes=i))
+        for i, user in enumerate(users)
+    ])
+    db.session.commit()
+    return users
+
+
+def _review_texts(response):
+    return re.findall(r'<p class="mb-0">(Отзыв \d+)</p>', response.text)
+
+
+def _next_link(response):
+    found = re.findall(r'reviews=([\w-]+)', response.text)
+    return found[0] if found else None
+
+
+def test_reviews_are_paginated_newest_first(client, book, roles):
+    _seed_reviews(book, roles, REVIEWS_PER_PAGE + 5)
+
+    first = client.get(f'/book/{book.id}')
+    texts = _review_texts(first)
+    assert len(texts) == REVIEWS_PER_PAGE
+    assert texts[0] == f'Отзыв {REVIEWS_PER_PAGE + 4}'
+    assert f'Отзывы ({REVIEWS_PER_PAGE + 5})' in first.text
+
+    second = client.get(f'/book/{book.id}?reviews={_next_link(first)}')
+    assert _review_texts(second) == [f'Отзыв {i}' for i in range(4, -1, -1)]
+    assert _next_link(second) is None
+
+
+def test_review_page_query_count_is_constant(client, book, roles):
+    book.render_description()
+    _seed_reviews(book, roles, 3)
+    small = client.get(f'/book/{book.id}')
+    db.session.add_all([
+        Review(book_id=book.id, user_id=make_user(f'extra{i}', roles['user']).id, rating=5, text='x')
+        for i in range(10)
+    ])
+    db.session.commit()
+    large = client.get(f'/book/{book.id}')
+    assert small.headers['X-Query-Count'] == large.headers['X-Query-Count'] == '3'
+
+
+def test_own_review_fetched_with_page(client, book, roles):
+    users = _seed_reviews(book, roles, REVIEWS_PER_PAGE + 3)
+    users[0].set_password('secret')
+    db.session.commit()
+    login_user(client, users[0].username, 'secret')
+
+    response = client.get(f'/book/{book.id}')
+    texts = _review_texts(response)
+    assert texts[0] == 'Отзыв 0'
+    assert 'Ваш отзыв' in response.text
+    assert len(texts) == REVIEWS_PER_PAGE + 1
+    assert 'Оставить отзыв' not in response.text
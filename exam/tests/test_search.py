@@ -0,0 +1,63 @@
+import re
+
+from app import db, Book, Genre
+from conftest import login_user, make_book
+
+
+def _titles(response):
+    return re.findall(r'<h5 class="mb-1">(.*?)</h5>', response.text)
+
+
+def _seed():
+    prose = Genre(name='Проза')
+    fantasy = Genre(name='Фантастика')
+    db.session.add_all([prose, fantasy])
+    make_book(title='Мастер и Маргарита', year=1967, genres=[prose])
+    make_book(title='Маргарита и море', year=2001, genres=[fantasy])
+    make_book(title='Солярис', year=1961, genres=[fantasy])
+    return prose, fantasy
+
+
+def test_search_ranks_and_counts_facets(client):
+    prose, fantasy = _seed()
+
+    response = client.get('/search?q=Маргарита')
+    assert response.status_code == 200
+    assert sorted(_titles(response)) == ['Маргарита и море', 'Мастер и Маргарита']
+    facets = dict(re.findall(r'\s+(\S+)\s+<span class="badge bg-secondary rounded-pill">(\d+)</span>', response.text))
+    assert facets == {'Проза': '1', 'Фантастика': '1'}
+
+
+def test_search_filters_by_genre_and_year(client):
+    prose, fantasy = _seed()
+
+    assert _titles(client.get(f'/search?q=Маргарита&genre={fantasy.id}')) == ['Маргарита и море']
+    assert _titles(client.get('/search?q=Маргарита&year_to=2000')) == ['Мастер и Маргарита']
+
+
+def test_search_index_follows_edits_and_deletes(client, admin_user):
+    _seed()
+    book = Book.query.filter_by(title='Солярис').one()
+    book.title = 'Солярис, Маргарита'
+    db.session.commit()
+    assert 'Солярис, Маргарита' in _titles(client.get('/search?q=Маргарита'))
+
+    login_user(client, 'admin', 'admin123')
+    client.post(f'/book/{book.id}/delete')
+    assert 'Солярис, Маргарита' not in _titles(client.get('/search?q=Маргарита'))
+
+
+def test_search_escapes_fts_syntax(client):
+    _seed()
+    response = client.get('/search', query_string={'q': 'Маргарита" OR NEAR(*'})
+    assert response.status_code == 200
+
+
+def test_reindex_search_command(runner, client):
+    _seed()
+    db.session.execute(db.text('DELETE FROM books_fts'))
+    db.session.commit()
+    assert _titles(client.get('/search?q=Солярис')) == []
+
+    assert runner.invoke(args=['books', 'reindex-search']).exit_code == 0
+    assert _titles(client.get('/search?q=Солярис')) == ['Солярис']